@@ -9,8 +9,11 @@ Scheme "Fuzzy Commitment"
 .. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
 
 """
+from __future__ import with_statement
 import scipy
+import threading
 from reedsolomon import IntegerCodec
+from crypto_list_decoding import get_list_decoder
 from Crypto.Hash import SHA256
 import os
 import logging
@@ -44,24 +47,14 @@ def safe_random(length, symsize=8):
         
     return urandom_list
 
-def JW_commit(x, m=15, n=20, symsize=8):
-    """*Juels Wattenberg* based function to make a fuzzy commitment
+def random_codeword(m=15, n=20, symsize=8):
+    """random codeword of the Reed-Solomon-Code :math:`RS(q=2^{symsize},m,n)`
     
-    m,n,symsize initializes Reed-Solomon-Code with :math:`RS(q=2^{symsize},m,n)`.
-                        * m -- Messages
-                        * n -- Codewords
-                        * Initializes Set of Codewords C
-                        
-    :param x: Input key x.
-    :type x: list
     :param m: Parameter for Reed-Solomon-Code.
     :param n: Parameter for Reed-Solomon-Code.
     :param symsize: Parameter for Reed-Solomon-Code.
-    :return: hash -- Hash of c.
-    :return: delta -- Difference between x and c.
     :return: c -- Randomly generated codeword :math:`c \in C`.
     """
-    
     # Reed Solomon Codeword Set C with RS(2**symsize, m, n)
     # m Messages
     # n Codewords
@@ -74,6 +67,102 @@ def JW_commit(x, m=15, n=20, symsize=8):
     c_pre = safe_random(m, symsize=symsize)
     # map c_pre to codeword c to get a real codeword in C
     c = scipy.array(C.encode(c_pre)) # now size n!
+    # c_pre is not needed anymore, overwrite it
+    c_pre[:] = [0]*m
+    return c
+
+class CommitmentPool(object):
+    """random codewords for ``JW_commit``, generated in advance
+    
+    Generating randomness and encoding take longer than the commitment
+    itself. The pool keeps ``size`` codewords ready, a background thread
+    generates new ones, for example while recording. Every codeword is
+    handed out only once and removed from the pool, the random messages
+    are never kept. ``stop`` overwrites the codewords left in the pool.
+    
+    :param m: Parameter for Reed-Solomon-Code.
+    :param n: Parameter for Reed-Solomon-Code.
+    :param symsize: Parameter for Reed-Solomon-Code.
+    :param size: Number of codewords kept ready.
+    """
+    def __init__(self, m=15, n=20, symsize=8, size=1):
+        self.m = m
+        self.n = n
+        self.symsize = symsize
+        self.size = size
+        self.codewords = []
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = None
+        
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+        
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and len(self.codewords) >= self.size:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            # generate outside of the lock, get does not wait for it
+            c = random_codeword(self.m, self.n, self.symsize)
+            with self.condition:
+                if not self.running:
+                    c[:] = 0
+                    return
+                self.codewords.append(c)
+                
+    def get(self):
+        """take a codeword out of the pool, it is generated now if
+        the pool is empty
+        
+        :return: c -- Randomly generated codeword :math:`c \in C`.
+        """
+        with self.condition:
+            if self.codewords:
+                c = self.codewords.pop(0)
+                self.condition.notifyAll()
+                return c
+        log.debug('Commitment pool is empty')
+        return random_codeword(self.m, self.n, self.symsize)
+        
+    def stop(self):
+        """stop generating and overwrite unused codewords"""
+        with self.condition:
+            self.running = False
+            for c in self.codewords:
+                c[:] = 0
+            self.codewords = []
+            self.condition.notifyAll()
+
+def JW_commit(x, m=15, n=20, symsize=8, codeword=None):
+    """*Juels Wattenberg* based function to make a fuzzy commitment
+    
+    m,n,symsize initializes Reed-Solomon-Code with :math:`RS(q=2^{symsize},m,n)`.
+                        * m -- Messages
+                        * n -- Codewords
+                        * Initializes Set of Codewords C
+                        
+    :param x: Input key x.
+    :type x: list
+    :param m: Parameter for Reed-Solomon-Code.
+    :param n: Parameter for Reed-Solomon-Code.
+    :param symsize: Parameter for Reed-Solomon-Code.
+    :param codeword: Random codeword of the same code, like from ``CommitmentPool.get``, generated if None. Never use a codeword twice!
+    :return: hash -- Hash of c.
+    :return: delta -- Difference between x and c.
+    :return: c -- Randomly generated codeword :math:`c \in C`.
+    """
+    
+    if codeword is None:
+        c = random_codeword(m, n, symsize)
+    else:
+        c = codeword
     log.debug('random codeword c in C:\n'+str(c))
     log.debug('length of codeword c: '+str(len(c)))
     
@@ -87,7 +176,39 @@ def JW_commit(x, m=15, n=20, symsize=8):
     return hash, delta, c
     
     
-def JW_decommit(hash, delta, x2, m=15, n=20, symsize=8):
+def get_erasures(reliability, count):
+    """positions of the ``count`` least reliable symbols
+    
+    :param reliability: Reliability of every symbol, higher is better.
+    :param count: Number of erasures.
+    :return: erasures -- Sorted list of positions.
+    """
+    if count <= 0:
+        return []
+    # stable sort, so equal reliabilities keep their order
+    positions = scipy.argsort(reliability, kind='mergesort')[0:count]
+    return sorted(positions.tolist())
+    
+def get_erasure_counts(m=15, n=20, steps=8):
+    """numbers of erasures tried by ``JW_decommit`` when reliabilities
+    are given
+    
+    RS codes correct :math:`R` errors and :math:`S` erasures as long as
+    :math:`2R+S \leq n-m`. Erasing a position is only cheaper than
+    correcting it if the position is wrong, so no single number of
+    erasures is best for every input. Like Forney's generalized minimum
+    distance decoding, several numbers are tried: none first,
+    then growing in ``steps`` steps up to :math:`n-m-1`.
+    
+    :param m: Parameter for Reed-Solomon-Code.
+    :param n: Parameter for Reed-Solomon-Code.
+    :param steps: Number of different erasure counts besides 0.
+    :return: erasure_counts -- List of erasure counts.
+    """
+    step = max(1, (n-m) / (steps+1))
+    return range(0, n-m, step)[0:steps+1]
+    
+def JW_decommit(hash, delta, x2, m=15, n=20, symsize=8, reliability=None, erasure_counts=None, list_decoding=False, multiplicity=2):
     """Juels Wattenberg function to decommit a fuzzy commitment
     
     m,n,symsize initializes Reed-Solomon-Code with :math:`RS(q=2^{symsize},m,n)`.
@@ -95,6 +216,15 @@ def JW_decommit(hash, delta, x2, m=15, n=20, symsize=8):
                         * n -- Codewords
                         * Initializes Set of Codewords C
     
+    If ``reliability`` is given, the least reliable positions of ``x2``
+    are marked as erasures. Every number of erasures in ``erasure_counts``
+    is tried until the hash matches, see ``get_erasure_counts``.
+    
+    If ``list_decoding`` is set and the unique decoder fails, the
+    Guruswami-Sudan list decoder searches a larger radius, see
+    ``crypto_list_decoding``. Every codeword in the list is checked
+    against ``hash``.
+    
     :param hash: Hash of c from Alice.
     :param delta: Difference from Alice.
     :param x2: Own input key x2. Slightly different from Alice x.
@@ -102,6 +232,10 @@ def JW_decommit(hash, delta, x2, m=15, n=20, symsize=8):
     :param m: Parameter for Reed-Solomon-Code.
     :param n: Parameter for Reed-Solomon-Code.
     :param symsize: Parameter for Reed-Solomon-Code.
+    :param reliability: Optional reliability of every symbol in x2.
+    :param erasure_counts: Numbers of erasures to try with ``reliability``.
+    :param list_decoding: Use list decoding when unique decoding fails.
+    :param multiplicity: Multiplicity for list decoding, higher corrects more but is slower.
     
     :return: c2 -- Decommited c2 
     :return: corrections -- List of corrections made by Reed-Solomon
@@ -119,12 +253,39 @@ def JW_decommit(hash, delta, x2, m=15, n=20, symsize=8):
     # size -> 2**symsize -1
     C = IntegerCodec(n, m, symsize=symsize)
     
+    if reliability is None:
+        if not list_decoding:
+            return _decommit_diff(C, hash, diff, [])
+        erasure_counts = [0]
+    elif erasure_counts is None:
+        erasure_counts = get_erasure_counts(m, n)
+    
+    for count in erasure_counts:
+        erasures = get_erasures(reliability, count)
+        try:
+            c2, corrections = _decommit_diff(C, hash, diff, erasures)
+        except RuntimeError, err:
+            log.debug('Decommit with '+str(count)+' erasures failed: '+str(err))
+        else:
+            log.info('Decommit successfull with '+str(count)+' erasures')
+            return c2, corrections
+    
+    if list_decoding:
+        return _list_decommit_diff(C, hash, diff, multiplicity)
+    
+    raise RuntimeError("Decommit failed with all erasure counts "+str(erasure_counts))
+    
+def _decommit_diff(C, hash, diff, erasures):
+    """decode ``diff`` with the erasures and compare the hash
+    of the codeword, see ``JW_decommit``
+    """
     # map diff to nearest codeword c_pre
     try:
-        c_pre, corrections = C.decode(diff)
+        c_pre, corrections = C.decode(diff, erasures)
     except Exception, err:
-        log.error('%s' % str(err))
-        raise RuntimeError("Error in Decode of Reedsolomon Library")
+        # expected for every erasure count that is too small,
+        # the caller reports the failure
+        raise RuntimeError("Error in Decode of Reedsolomon Library: "+str(err))
     else:
         # expand codeword c_pre to get c
         c2 = scipy.array(C.encode(c_pre))
@@ -144,3 +305,27 @@ def JW_decommit(hash, delta, x2, m=15, n=20, symsize=8):
             raise RuntimeError("Hashs are not equal h(c)!=h(c')")
         
         return c2, corrections
+    
+def _list_decommit_diff(C, hash, diff, multiplicity):
+    """list decode ``diff`` and compare the hash of every codeword
+    in the list, see ``JW_decommit``
+    """
+    decoder = get_list_decoder(C, multiplicity)
+    codewords = decoder.decode(diff)
+    
+    for codeword in codewords:
+        # expand message part to get c like the unique decoder
+        c2 = scipy.array(C.encode(codeword[0:C.k].tolist()))
+        
+        # generate SHA-256 Hash
+        hash_obj = SHA256.new("".join(c2.astype(str)))
+        hash2 = hash_obj.hexdigest().split()
+        
+        if (hash == hash2):
+            corrections = scipy.nonzero(c2 != diff)[0].tolist()
+            log.info("List decommit successfull h(c)=h(c')")
+            log.debug('List decoding made corrections on (positions):\n'+str(corrections))
+            log.debug('List decoding number of corrections: '+str(len(corrections)))
+            return c2, corrections
+    
+    raise RuntimeError("List decoding found no codeword with h(c)=h(c') in "+str(len(codewords))+" codewords within radius "+str(decoder.radius))
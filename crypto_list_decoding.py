@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+List decoding of Reed-Solomon codes based on Guruswami & Sudan
+
+    :platform: Linux
+    :synopsis: List decoding beyond half the minimum distance
+
+The unique decoder of the reedsolomon library corrects at most
+:math:`(n-k)/2` errors. The Guruswami-Sudan algorithm returns every
+codeword within a larger radius of up to :math:`n-\sqrt{n(k-1)}`.
+It interpolates a bivariate polynomial :math:`Q(x,y)` through every
+received symbol with multiplicity ``multiplicity`` (Koetter's algorithm)
+and finds all factors :math:`y-f(x)` with :math:`deg(f)<k`
+(Roth-Ruckenstein algorithm).
+
+The codes of the reedsolomon library are cyclic codes. They are
+decoded as generalized Reed-Solomon codes with evaluation points
+:math:`\\beta_j` and column multipliers :math:`v_j`, so every returned
+codeword is a codeword of the ``IntegerCodec``.
+
+For RS(512,152) with 10 bit symbols and multiplicity 2 the radius
+grows from 180 to 207 errors. Decoding takes much longer than the unique
+decoder, so it should only be used when the unique decoder failed.
+
+"""
+import numpy
+
+import logging
+# get logger
+log = logging.getLogger("fuzzy_pairing")
+
+# decoders are expensive to set up, keep them by code parameters
+_decoders = {}
+
+
+class GaloisField(object):
+    """Arithmetic in :math:`GF(2^{symsize})` on numpy arrays
+
+    Elements are integers in polynomial basis like in the reedsolomon
+    library. Multiplications use logarithm tables, additions are xor.
+
+    :param symsize: Size of symbols in bits.
+    :param gfpoly: Field generator polynomial.
+    """
+    def __init__(self, symsize, gfpoly):
+        self.size = 2**symsize
+        self.order = self.size - 1
+
+        # exp is long enough to look up the sum of two logarithms,
+        # the logarithm of 0 is so large that every product with
+        # 0 ends in the zero part of exp
+        self.exp = numpy.zeros(4*self.order+1, dtype=numpy.int64)
+        self.log = numpy.zeros(self.size, dtype=numpy.int64)
+        element = 1
+        for i in range(self.order):
+            self.exp[i] = element
+            self.exp[i+self.order] = element
+            self.log[element] = i
+            element <<= 1
+            if element & self.size:
+                element ^= gfpoly
+        if element != 1:
+            raise ValueError("gfpoly is not primitive")
+        self.log[0] = 2*self.order
+
+    def mul(self, a, b):
+        """elementwise product of ``a`` and ``b``"""
+        return self.exp[self.log[a] + self.log[b]]
+
+    def inv(self, a):
+        """elementwise inverse of ``a``, which must not contain 0"""
+        return self.exp[self.order - self.log[a]]
+
+    def powers(self, a, count):
+        """:math:`a^0, ..., a^{count-1}` of a single element ``a``"""
+        if a == 0:
+            result = numpy.zeros(count, dtype=numpy.int64)
+            result[0] = 1
+            return result
+        exponents = (self.log[a] * numpy.arange(count)) % self.order
+        return self.exp[exponents]
+
+    def evaluate(self, poly, points):
+        """evaluate polynomial ``poly`` (lowest coefficient first)
+        at every element of ``points``"""
+        result = numpy.zeros(len(points), dtype=numpy.int64)
+        for coefficient in poly[::-1]:
+            result = self.mul(result, points) ^ coefficient
+        return result
+
+
+def _binomials_mod2(count, k):
+    """:math:`\\binom{u}{k} \\bmod 2` for :math:`u=0,...,count-1`
+    (Lucas' theorem)"""
+    u = numpy.arange(count)
+    return (u & k) == k
+
+
+def get_list_parameters(n, k, multiplicity=2):
+    """weighted degree, list size and radius of the Guruswami-Sudan
+    decoder
+
+    The interpolation polynomial must satisfy :math:`n\\binom{m+1}{2}`
+    linear constraints, so it needs more monomials of
+    :math:`(1,k-1)`-weighted degree ``degree``. Every codeword that
+    agrees in more than :math:`degree/m` positions is found.
+
+    :param n: Parameter for Reed-Solomon-Code.
+    :param k: Parameter for Reed-Solomon-Code (Messages).
+    :param multiplicity: Multiplicity :math:`m` of every received symbol.
+    :return: degree -- Maximal weighted degree of :math:`Q(x,y)`.
+    :return: list_size -- Maximal degree of :math:`Q(x,y)` in :math:`y`.
+    :return: radius -- Number of errors corrected.
+    """
+    constraints = n * multiplicity * (multiplicity+1) / 2
+    degree = 0
+    while True:
+        list_size = degree / max(1, k-1)
+        monomials = sum([degree - l*(k-1) + 1 for l in range(list_size+1)])
+        if monomials > constraints:
+            break
+        degree += 1
+    radius = n - degree/multiplicity - 1
+    return degree, list_size, radius
+
+
+class ListDecoder(object):
+    """Guruswami-Sudan list decoder for the codewords of an
+    ``IntegerCodec``
+
+    :param codec: ``reedsolomon.IntegerCodec`` defining the code.
+    :param multiplicity: Multiplicity of every received symbol,
+                         larger values correct more errors but are slower.
+    """
+    def __init__(self, codec, multiplicity=2):
+        self.n = codec.n
+        self.k = codec.k
+        self.multiplicity = multiplicity
+        self.field = GaloisField(codec.symsize, codec.gfpoly)
+        gf = self.field
+
+        self.degree, self.list_size, self.radius = get_list_parameters(self.n, self.k, multiplicity)
+
+        # the codeword c is a polynomial with c[j] at x^(n-1-j)
+        # and roots alpha^(prim*(fcr+i)), i = 0, ..., nroots-1,
+        # so position j is evaluated at beta_j = alpha^(prim*(n-1-j))
+        exponents = (codec.prim * numpy.arange(self.n-1, -1, -1)) % gf.order
+        self.points = gf.exp[exponents]
+
+        # column multipliers v_j = 1/(beta_j^fcr * prod_(i!=j)(beta_j - beta_i))
+        # turn the parity check equations into a GRS code
+        multipliers = numpy.zeros(self.n, dtype=numpy.int64)
+        for j in range(self.n):
+            differences = self.points[j] ^ numpy.delete(self.points, j)
+            log_sum = gf.log[differences].sum() + codec.fcr * gf.log[self.points[j]]
+            multipliers[j] = gf.exp[(-log_sum) % gf.order]
+        self.multipliers = multipliers
+
+    def decode(self, received, erasures=[]):
+        """all codewords within the radius of ``received``
+
+        Erased positions are left out of the interpolation, so the
+        radius applies to the remaining :math:`n-len(erasures)` positions.
+
+        :param received: Received word of n symbols.
+        :param erasures: Positions to ignore.
+        :return: codewords -- List of numpy arrays, nearest first.
+        """
+        gf = self.field
+        received = numpy.asarray(received, dtype=numpy.int64)
+
+        positions = numpy.setdiff1d(numpy.arange(self.n), numpy.asarray(erasures, dtype=numpy.int64))
+        degree, list_size, radius = get_list_parameters(len(positions), self.k, self.multiplicity)
+
+        # divide out the column multipliers to get a RS code
+        # evaluating polynomials f with deg(f) < k
+        values = gf.mul(received, gf.inv(self.multipliers))
+
+        Q = self._interpolate(self.points[positions], values[positions], degree, list_size)
+
+        codewords = []
+        for f in self._find_roots(Q):
+            codeword = gf.mul(self.multipliers, gf.evaluate(f, self.points))
+            errors = numpy.count_nonzero(codeword[positions] != received[positions])
+            if errors <= radius:
+                codewords.append((errors, codeword))
+
+        codewords.sort(key=lambda item: item[0])
+        log.debug('List decoding found '+str(len(codewords))+' codewords within radius '+str(radius))
+        return [codeword for errors, codeword in codewords]
+
+    def _interpolate(self, xs, ys, degree, list_size):
+        """Koetter's algorithm: find :math:`Q(x,y)` with minimal
+        :math:`(1,k-1)`-weighted degree through every point with
+        multiplicity ``self.multiplicity``
+
+        :return: Q -- coefficients, ``Q[l, a]`` belongs to :math:`y^l x^a`
+        """
+        gf = self.field
+        m = self.multiplicity
+        columns = degree + 2
+
+        # start with Q_l = y^l, coefficients [polynomial, y power, x power]
+        Q = numpy.zeros((list_size+1, list_size+1, columns), dtype=numpy.int64)
+        for l in range(list_size+1):
+            Q[l, l, 0] = 1
+        weighted = [l*(self.k-1) for l in range(list_size+1)]
+        # polynomials with weighted degree above ``degree`` are dropped
+        active = range(list_size+1)
+
+        masks_x = [_binomials_mod2(columns, a) for a in range(m)]
+        masks_y = [_binomials_mod2(list_size+1, b) for b in range(m)]
+
+        for x, y in zip(xs, ys):
+            powers_x = gf.powers(x, columns)
+            powers_y = gf.powers(y, list_size+1)
+
+            # Hasse derivatives D_(a,b) in this order keep the earlier
+            # constraints satisfied when multiplying by (x - x_i)
+            for a in range(m):
+                weights_x = numpy.zeros(columns, dtype=numpy.int64)
+                weights_x[a:] = powers_x[:columns-a]
+                weights_x[~masks_x[a]] = 0
+
+                # evaluate x-derivative a at x for every active polynomial
+                Qx = numpy.bitwise_xor.reduce(gf.mul(Q[active], weights_x), axis=2)
+
+                for b in range(m-a):
+                    weights_y = numpy.zeros(list_size+1, dtype=numpy.int64)
+                    weights_y[b:] = powers_y[:list_size+1-b]
+                    weights_y[~masks_y[b]] = 0
+
+                    discrepancies = numpy.bitwise_xor.reduce(gf.mul(Qx, weights_y), axis=1)
+                    nonzero = [i for i, d in enumerate(discrepancies) if d != 0]
+                    if not nonzero:
+                        continue
+
+                    # polynomial with minimal weighted degree
+                    pivot = min(nonzero, key=lambda i: weighted[active[i]])
+                    p = active[pivot]
+                    pivot_inverse = gf.inv(discrepancies[pivot])
+
+                    for i in nonzero:
+                        if i == pivot:
+                            continue
+                        factor = gf.mul(discrepancies[i], pivot_inverse)
+                        Q[active[i]] ^= gf.mul(Q[p], factor)
+                        Qx[i] ^= gf.mul(Qx[pivot], factor)
+
+                    # Q_p = (x - x_i) * Q_p
+                    shifted = numpy.zeros_like(Q[p])
+                    shifted[:, 1:] = Q[p][:, :-1]
+                    Q[p] = shifted ^ gf.mul(Q[p], x)
+                    weighted[p] += 1
+
+                    if weighted[p] > degree:
+                        del active[pivot]
+                        Qx = numpy.delete(Qx, pivot, axis=0)
+                    else:
+                        # the remaining discrepancies of the new Q_p in
+                        # this loop are zero, so it is never the pivot again
+                        Qx[pivot] = 0
+
+        best = min(active, key=lambda l: weighted[l])
+        return Q[best]
+
+    def _find_roots(self, Q):
+        """Roth-Ruckenstein algorithm: all polynomials f with
+        :math:`deg(f)<k` and :math:`Q(x,f(x))=0`
+
+        :return: polynomials -- List of coefficient lists, lowest first.
+        """
+        gf = self.field
+        elements = numpy.arange(gf.size)
+        # y^l for every element of the field
+        element_powers = numpy.array([gf.powers(e, Q.shape[0]) for e in elements])
+
+        polynomials = []
+        stack = [(Q, [])]
+        while stack:
+            Q, prefix = stack.pop()
+
+            # divide by the largest power of x
+            used = numpy.nonzero(Q.any(axis=0))[0]
+            if len(used) == 0:
+                # Q is zero, every continuation is a root, but
+                # interpolation never returns a multiple of y - f(x)
+                # with this little information
+                continue
+            Q = Q[:, used[0]:used[-1]+1]
+
+            # roots of Q(0, y)
+            values = numpy.bitwise_xor.reduce(gf.mul(element_powers, Q[:, 0]), axis=1)
+            for root in numpy.nonzero(values == 0)[0]:
+                f = prefix + [int(root)]
+                if len(f) == self.k:
+                    polynomials.append(f)
+                else:
+                    stack.append((self._substitute(Q, root), f))
+
+        return polynomials
+
+    def _substitute(self, Q, root):
+        """coefficients of :math:`Q(x, xy + root)`"""
+        gf = self.field
+        rows, columns = Q.shape
+
+        # Q(x, y + root)
+        powers = gf.powers(root, rows)
+        shifted = numpy.zeros_like(Q)
+        for w in range(rows):
+            mask = _binomials_mod2(rows, w)
+            for v in range(w, rows):
+                if mask[v]:
+                    shifted[w] ^= gf.mul(Q[v], powers[v-w])
+
+        # y -> x*y
+        result = numpy.zeros((rows, columns+rows-1), dtype=numpy.int64)
+        for w in range(rows):
+            result[w, w:w+columns] = shifted[w]
+        return result
+
+
+def get_list_decoder(codec, multiplicity=2):
+    """cached ``ListDecoder`` for the code of ``codec``
+
+    :param codec: ``reedsolomon.IntegerCodec`` defining the code.
+    :param multiplicity: Multiplicity of every received symbol.
+    :return: decoder -- ``ListDecoder``
+    """
+    key = (codec.n, codec.k, codec.symsize, codec.gfpoly, codec.fcr, codec.prim, multiplicity)
+    if key not in _decoders:
+        _decoders[key] = ListDecoder(codec, multiplicity)
+    return _decoders[key]
@@ -12,11 +12,81 @@ Fingerprinting based on Energy Differences
 import scipy
 from scipy import fftpack
 from scipy import signal
+from fractions import Fraction
+import math
 import logging
 import sys
 # get logger
 log = logging.getLogger("fuzzy_pairing")
 
+# frequency band length at the full samplerate and the number of
+# bands it gives at 44.1 kHz, decimated fingerprints keep this number
+FREQUENCY_BAND_LENGTH = 250
+FREQUENCY_BANDS = 33
+
+def get_resample_ratio(samplerate, fingerprint_rate):
+    """exact ratio of ``fingerprint_rate`` to ``samplerate`` as reduced
+    fraction (44100 Hz to 5512.5 Hz is 1/8, 48000 Hz to 5512.5 Hz is
+    147/1280), so the data is resampled to exactly ``fingerprint_rate``
+    
+    :return: up, down -- samplerate*up/down is ``fingerprint_rate``
+    """
+    ratio = Fraction(str(fingerprint_rate)) / Fraction(str(samplerate))
+    return ratio.numerator, ratio.denominator
+
+def resample(data, samplerate, fingerprint_rate):
+    """low-pass filter and decimate data to ``fingerprint_rate``
+    
+    Uses a polyphase resampler, the ratio of the rates
+    comes from ``get_resample_ratio``.
+    
+    :param data: One-dimensional array with the audio data
+    :param samplerate: samplerate of data
+    :param fingerprint_rate: samplerate for fingerprinting
+    :return: data -- resampled data
+    :return: samplerate -- exact samplerate of resampled data
+    """
+    up, down = get_resample_ratio(samplerate, fingerprint_rate)
+    if up == down:
+        return data, samplerate
+    log.debug('Fingerprinting: resample by '+str(up)+'/'+str(down))
+    
+    data = scipy.asarray(data, dtype=float)
+    if hasattr(signal, 'resample_poly'):
+        data = signal.resample_poly(data, up, down)
+    else:
+        # old scipy without polyphase resampler
+        data = signal.resample(data, int(math.ceil(len(data)*up/float(down))))
+    return data, samplerate*float(up)/down
+
+def get_fft_length(frame_length):
+    """fast fft length of at least ``frame_length``
+    
+    Frames of decimated data can have lengths fftpack is very slow
+    for (2039 at 5512.5 Hz is prime), so they are padded with zeros.
+    """
+    if hasattr(fftpack, 'next_fast_len'):
+        return fftpack.next_fast_len(frame_length)
+    return 2**int(math.ceil(math.log(frame_length, 2)))
+
+def get_frequency_band_length(samplerate):
+    """length of the frequency bands in ``calculate_energy`` for
+    decimated data
+    
+    Decimated data has less frequencies per frame than the 250 long
+    bands need, so the length is chosen to give at least
+    ``FREQUENCY_BANDS`` bands. ``calculate_energy`` drops the bands
+    above, so there are 32 bits per frame.
+    
+    :param samplerate: samplerate of the decimated data
+    :return: frequency_band_length
+    """
+    frequencies = get_fft_length(int(0.37 * samplerate))/2
+    length = int(math.ceil(frequencies / float(FREQUENCY_BANDS)))
+    while length > 1 and len(range(0, frequencies, length)) < FREQUENCY_BANDS:
+        length -= 1
+    return length
+
 def get_frames(data, samplerate, overlap_factor=0.0):
     """Split data into frames
     
@@ -37,7 +107,7 @@ def get_frames(data, samplerate, overlap_factor=0.0):
     frame_length = int(0.37 * samplerate)
     
     log.debug("overlap factor: "+str(overlap_factor))
-    overlap = frame_length * overlap_factor
+    overlap = int(frame_length * overlap_factor)
     log.debug("overlap: "+str(overlap))
     
     frames_count = int((data_length-overlap) / frame_length)
@@ -56,7 +126,7 @@ def get_frames(data, samplerate, overlap_factor=0.0):
     return frames
     
     
-def frames_fft(frames, weighted = True):
+def frames_fft(frames, weighted = True, fft_length=None):
     """doing fast fourier transformations on each frame vector
     in frames
     
@@ -66,6 +136,8 @@ def frames_fft(frames, weighted = True):
     :type frames: scipy.array
     :param weighted: Should it be weighted by hamming-window?
     :type weighted: bool
+    :param fft_length: Pad frames with zeros to this length, see ``get_fft_length``
+    :type fft_length: int
     :return: frames_frequency -- Frequencies per frame 
     """
     log.debug('Fingerprinting: frames_fft')
@@ -102,7 +174,7 @@ def frames_fft(frames, weighted = True):
         #frames_frequency[i] = signal.lfilter(d, 1, frames[i])
         
         # do fft and use absolute value
-        frames_frequency[i] = scipy.array(abs(fftpack.fft(frames_frequency[i])))
+        frames_frequency[i] = scipy.array(abs(fftpack.fft(frames_frequency[i], fft_length)))
         
         # cut out mirrored
         frames_frequency[i] = frames_frequency[i][0:len(frames_frequency[i])/2]
@@ -110,7 +182,7 @@ def frames_fft(frames, weighted = True):
     return frames_frequency
     
     
-def calculate_energy(frames_frequency, frequency_band_length):
+def calculate_energy(frames_frequency, frequency_band_length, bands=None):
     """divide into frequency bands and calculate energy
     
     Optional TODO: Implement band range (bottom and top)
@@ -120,6 +192,8 @@ def calculate_energy(frames_frequency, frequency_band_length):
     :type frames_frequency: scipy.array
     :param frequency_band_length: length of every frequency band
     :type frequency_band_length: int
+    :param bands: maximal number of bands, the top bands above are dropped
+    :type bands: int
     :return: frames_energy -- Two-dimensional array with energy list per Frame
     """
     log.debug('Fingerprinting: calculate_energy')
@@ -133,7 +207,7 @@ def calculate_energy(frames_frequency, frequency_band_length):
     frame_length = len(frames_frequency[0])
     
     # define frequency bands
-    frequency_bands = range(0, frame_length, frequency_band_length)
+    frequency_bands = range(0, frame_length, frequency_band_length)[:bands]
     #log.debug('number of frequency bands: '+repr(len(frequency_bands)))
     
     # every frame
@@ -163,7 +237,7 @@ def calculate_energy(frames_frequency, frequency_band_length):
     return frames_energy
     
     
-def calculate_difference(frames_energy):
+def calculate_difference(frames_energy, reliability=False):
     """calculate difference of energies
     
     Implementation following paper "A Highly Robust Audio Fingerprinting System"
@@ -172,14 +246,24 @@ def calculate_difference(frames_energy):
     
     :math:`F(n,m)=0` if :math:`E(n,m)-E(n,m+1)-(E(n-1,m)-E(n-1,m+1))\leq 0`
     
+    The reliability of a bit is the magnitude of this difference
+    relative to the four energies involved, a value between 0 and 1.
+    Bits with a low reliability are close to the decision threshold
+    and flip easily between two recordings.
+    
     :param frames_energy: frames of energys
     :type frames_energy: scipy.array
+    :param reliability: Also return the reliability of every bit?
+    :type reliability: bool
     :return: fingerint
+    :return: reliabilities -- Only if ``reliability`` is True
     """
     log.debug('Fingerprinting: calculate_difference')
 
     # fingerprint vector
     fingerprint = scipy.array([], dtype=int)
+    # reliability of every bit in fingerprint
+    reliabilities = []
     
     # first frame is defined as previous frame
     prev_frame = frames_energy[0]
@@ -189,45 +273,103 @@ def calculate_difference(frames_energy):
     for n, frame in enumerate(frames_energy):
         # every energy of frequency bands until length-1
         for m in range(len(frame)-1):
-            # calculate difference with formula from paper            
-            if (frame[m]-frame[m+1]-(prev_frame[m]-prev_frame[m+1]) > 0):
+            # calculate difference with formula from paper
+            difference = frame[m]-frame[m+1]-(prev_frame[m]-prev_frame[m+1])
+            if (difference > 0):
                 fingerprint = scipy.append(fingerprint, 1)
             else:
                 fingerprint = scipy.append(fingerprint, 0)
             
+            if reliability:
+                # energies are squares, so this sum is never negative
+                total = frame[m]+frame[m+1]+prev_frame[m]+prev_frame[m+1]
+                if total > 0:
+                    reliabilities.append(abs(difference) / total)
+                else:
+                    reliabilities.append(0.0)
+            
         prev_frame = frame
-        
+    
+    if reliability:
+        return fingerprint, scipy.array(reliabilities)
     return fingerprint
 
 
 
-def calculate_fingerprint(data, samplerate):
+def calculate_fingerprint(data, samplerate, reliability=False, fingerprint_rate=None):
     """calculate fingerprint of given data
     
+    With ``fingerprint_rate`` the data is decimated first (see
+    ``resample``), the frames then need about 8 times less work at
+    5512.5 Hz. Recordings with different samplerates give comparable
+    fingerprints, but both devices have to use the same
+    ``fingerprint_rate``.
+    
     :param data: Should be a one dimensional vector, that holds the audiodata in mono
     :type data: list
     :param samplerate: Samplerate of audio data
     :type samplerate: int
+    :param reliability: Also return the reliability of every bit, see ``calculate_difference``
+    :type reliability: bool
+    :param fingerprint_rate: Samplerate for fingerprinting, None for the samplerate of data
     :return: fingerprint
+    :return: reliabilities -- Only if ``reliability`` is True
     """
+    frequency_band_length = FREQUENCY_BAND_LENGTH
+    fft_length = None
+    bands = None
+    if fingerprint_rate is not None:
+        data, samplerate = resample(data, samplerate, fingerprint_rate)
+        frequency_band_length = get_frequency_band_length(samplerate)
+        fft_length = get_fft_length(int(0.37 * samplerate))
+        # the partial top band is near nyquist, in the stopband of the resampler
+        bands = FREQUENCY_BANDS
+    
     # break data into frames
     frames = get_frames(data, samplerate, overlap_factor=0.0)
     # Overlapping makes no improvments:
     #frames = get_frames(data, samplerate, overlap_factor=31.0/32.0)
     
     # do fft on each frame
-    frames_frequency = frames_fft(frames, weighted = True)
+    frames_frequency = frames_fft(frames, weighted = True, fft_length = fft_length)
     
     # divide into frequency bands and calculate energy
-    frames_energy = calculate_energy(frames_frequency, 250)
+    frames_energy = calculate_energy(frames_frequency, frequency_band_length, bands)
 
-    # calculate energy difference
-    fingerprint = calculate_difference(frames_energy)
-    
+    # calculate energy difference (and reliabilities)
     # return fingerprint
-    return fingerprint
+    return calculate_difference(frames_energy, reliability=reliability)
+    
+def get_required_samples(samplerate, bits=512, frequency_band_length=FREQUENCY_BAND_LENGTH, fingerprint_rate=None):
+    """number of samples ``get_fingerprint`` needs for ``bits`` bits
+    
+    Frames are 0.37 seconds long, every frame after the first one
+    gives one bit less than it has frequency bands.
     
-def get_fingerprint(data, samplerate):
+    :param samplerate: Samplerate of audio data
+    :type samplerate: int
+    :param bits: Length of the fingerprint
+    :param frequency_band_length: Length of frequency bands like in ``calculate_fingerprint``
+    :param fingerprint_rate: Samplerate for fingerprinting, see ``calculate_fingerprint``
+    :return: samples -- Minimal length of data at ``samplerate``
+    """
+    rate = samplerate
+    if fingerprint_rate is not None:
+        up, down = get_resample_ratio(samplerate, fingerprint_rate)
+        rate = samplerate*float(up)/down
+        frequency_band_length = get_frequency_band_length(rate)
+    frame_length = int(0.37 * rate)
+    # the fft gives frame_length/2 frequencies
+    bands = len(range(0, frame_length/2, frequency_band_length))
+    if fingerprint_rate is not None:
+        bands = min(bands, FREQUENCY_BANDS)
+    bits_per_frame = bands - 1
+    frames = (bits + bits_per_frame - 1) / bits_per_frame + 1
+    if fingerprint_rate is None:
+        return frames * frame_length
+    return int(math.ceil(frames * frame_length * float(samplerate) / rate))
+    
+def get_fingerprint(data, samplerate, reliability=False, fingerprint_rate=None):
     """Just a wrapper of ``calculate_fingerprint`` to get
     the first 512 bits only.
     
@@ -235,13 +377,21 @@ def get_fingerprint(data, samplerate):
     :type data: list
     :param samplerate: Samplerate of audio data
     :type samplerate: int
+    :param reliability: Also return the reliability of every bit, see ``calculate_difference``
+    :type reliability: bool
+    :param fingerprint_rate: Samplerate for fingerprinting, see ``calculate_fingerprint``
     :return: fingerprint -- 512 bit fingerprint
+    :return: reliabilities -- 512 reliabilities, only if ``reliability`` is True
     """
-    # calculate fingerprint
-    fingerprint = calculate_fingerprint(data, samplerate)
-    
     # take only first 512 bits
     # -> (2 fingerprintblocks with total 16 frames)
+    if reliability:
+        fingerprint, reliabilities = calculate_fingerprint(data, samplerate, reliability=True, fingerprint_rate=fingerprint_rate)
+        return fingerprint[0:512], reliabilities[0:512]
+    
+    # calculate fingerprint
+    fingerprint = calculate_fingerprint(data, samplerate, fingerprint_rate=fingerprint_rate)
+    
     fingerprint = fingerprint[0:512]
     
     return fingerprint
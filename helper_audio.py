@@ -13,12 +13,162 @@ import logging
 log = logging.getLogger("fuzzy_pairing")
 
 
+import os
+import struct
+import numpy
 from scipy.io import wavfile
 
-from helper_audio_decoder import read_as_array
+# format tags in the fmt chunk of wave files
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# cache for files decoded with gstreamer, see enable_cache
+_cache = None
+
+def enable_cache(directory=None, max_bytes=None):
+    """cache files decoded with gstreamer on disk, so
+    ``load_mono`` and ``load_stereo`` decode every file only once
+    
+    :param directory: Directory of the cache, default is ~/.cache/fuzzy_pairing/audio
+    :param max_bytes: Maximal size of the cache in bytes
+    :return: cache -- The ``helper_audio_cache.AudioCache``
+    """
+    global _cache
+    from helper_audio_cache import AudioCache, DEFAULT_DIRECTORY, DEFAULT_MAX_BYTES
+    if directory is None:
+        directory = DEFAULT_DIRECTORY
+    if max_bytes is None:
+        max_bytes = DEFAULT_MAX_BYTES
+    _cache = AudioCache(directory, max_bytes)
+    return _cache
+
+def disable_cache():
+    """decode files with gstreamer on every load again"""
+    global _cache
+    _cache = None
+
+def read_wave_header(filename):
+    """parse the header of a RIFF wave file
+    
+    :param filename: name of file, relative path
+    :type filename: str
+    :return: header -- dict with format, channels, samplerate, bits,
+             offset and size of the sample data or None if
+             the file is no wave file
+    """
+    header = {}
+    f = open(filename, 'rb')
+    try:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != 'RIFF' or riff[8:12] != 'WAVE':
+            return None
+        
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id = chunk[0:4]
+            chunk_size = struct.unpack('<I', chunk[4:8])[0]
+            
+            if chunk_id == 'fmt ':
+                fmt = f.read(chunk_size)
+                if len(fmt) < 16:
+                    return None
+                format, channels, samplerate, byterate, blockalign, bits = struct.unpack('<HHIIHH', fmt[0:16])
+                if format == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    # the first two bytes of the subformat GUID are the format tag
+                    format = struct.unpack('<H', fmt[24:26])[0]
+                header.update(format=format, channels=channels, samplerate=samplerate, bits=bits)
+            elif chunk_id == 'data':
+                if 'format' not in header:
+                    return None
+                offset = f.tell()
+                # recordings that were not finished properly
+                # have no or a wrong size in the header
+                available = os.path.getsize(filename) - offset
+                if chunk_size == 0 or chunk_size > available:
+                    chunk_size = available
+                header.update(offset=offset, size=chunk_size)
+                return header
+            else:
+                f.seek(chunk_size, 1)
+            
+            # chunks are padded to an even size
+            if chunk_size % 2:
+                f.seek(1, 1)
+    finally:
+        f.close()
+
+def read_wave_as_array(filename, header=None):
+    """memory map a 16 bit PCM wave file as numpy array
+    
+    The samples are not copied, pages of the file are read
+    when they are used.
+    
+    :param filename: name of file, relative path
+    :type filename: str
+    :param header: header from ``read_wave_header``, if already parsed
+    :return: data -- read only numpy.memmap, shape (channels, samples) for stereo
+    :return: duration -- Duration in seconds
+    :return: channels -- Number of channels
+    :return: samplerate -- Samplerate of audio file
+    :raise: ValueError if the file is no 16 bit PCM wave file
+    """
+    if header is None:
+        header = read_wave_header(filename)
+    if header is None or header['format'] != WAVE_FORMAT_PCM or header['bits'] != 16:
+        raise ValueError(filename+" is no 16 bit PCM wave file")
+    
+    channels = header['channels']
+    samplerate = header['samplerate']
+    frames = header['size'] / (2*channels)
+    
+    if frames == 0:
+        # numpy can not map empty files
+        data = numpy.zeros((frames, channels), dtype='<i2')
+    else:
+        data = numpy.memmap(filename, dtype='<i2', mode='r', offset=header['offset'], shape=(frames, channels))
+    
+    # interleaved channels, so every channel is a strided view
+    if channels == 1:
+        data = data[:,0]
+    else:
+        data = data.T
+    
+    duration = float(frames) / samplerate
+    return data, duration, channels, samplerate
+
+def read_audio(filename):
+    """read audio file as array
+    
+    16 bit PCM wave files are memory mapped by ``read_wave_as_array``,
+    all other formats are decoded with gstreamer or loaded from
+    the cache, see ``enable_cache``.
+    
+    :param filename: name of file, relative path
+    :type filename: str
+    :return: data, duration, channels, samplerate
+    """
+    header = read_wave_header(filename)
+    if header is not None and header['format'] == WAVE_FORMAT_PCM and header['bits'] == 16:
+        return read_wave_as_array(filename, header)
+    
+    if _cache is not None:
+        cached = _cache.get(filename)
+        if cached is not None:
+            return cached
+    
+    # gstreamer is only needed for compressed files
+    from helper_audio_decoder import read_as_array
+    data, duration, channels, samplerate = read_as_array(filename)
+    
+    if _cache is not None:
+        _cache.put(filename, data, duration, channels, samplerate)
+    return data, duration, channels, samplerate
 
 def load_stereo(filename):
-    """load stereo audio file with gstreamer
+    """load stereo audio file, wave files are memory mapped,
+    other formats are decoded with gstreamer
     
     :param filename: name of file, relative path
     :type filename: str
@@ -26,7 +176,7 @@ def load_stereo(filename):
     :return: right_channel -- Right channel as list
     :return: samplerate -- Samplerate of audio file
     """
-    data, duration, channels, samplerate = read_as_array(filename)
+    data, duration, channels, samplerate = read_audio(filename)
     log.debug("Load File "+filename+"\nduration: "+str(duration)+" seconds\nchannels: "+str(channels)+"\nsamplerate: "+str(samplerate))
     
     # seperate left and right channel
@@ -36,14 +186,15 @@ def load_stereo(filename):
     return left_channel, right_channel, samplerate
     
 def load_mono(filename):
-    """load mono audio file with gstreamer
+    """load mono audio file, wave files are memory mapped,
+    other formats are decoded with gstreamer
     
     :param filename: name of file, relative path
     :type filename: str
     :return: data -- Channel as list
     :return: samplerate -- Samplerate of audio file
     """
-    data, duration, channels, samplerate = read_as_array(filename)
+    data, duration, channels, samplerate = read_audio(filename)
     log.debug("Load File "+filename+"\nduration: "+str(duration)+" seconds\nchannels: "+str(channels)+"\nsamplerate: "+str(samplerate))
     
     return data, samplerate
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of decoded audio files
+
+    :platform: Linux
+    :synopsis: Audio Cache
+
+Decoding compressed files with gstreamer is slow and happens on every
+run of the analysis scripts. The cache stores the decoded samples as
+**.npy** files, which are memory mapped when they are loaded again.
+Entries are identified by absolute path, size and modification time of
+the audio file, so changed files are decoded again. If the cache grows
+above ``max_bytes`` the least recently used entries are removed.
+
+Use ``helper_audio.enable_cache`` to put the cache behind
+``load_mono`` and ``load_stereo``.
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+import os
+import json
+import hashlib
+import tempfile
+import numpy
+
+import logging
+# get logger
+log = logging.getLogger("fuzzy_pairing")
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "fuzzy_pairing", "audio")
+DEFAULT_MAX_BYTES = 2*1024**3
+
+
+class AudioCache(object):
+    """Cache of decoded audio in ``directory``
+
+    :param directory: Directory for the cache files, created if needed.
+    :param max_bytes: Maximal size of all cached samples in bytes.
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _key(self, filename):
+        """name of the cache entry for the current version of ``filename``"""
+        path = os.path.abspath(os.path.expanduser(filename))
+        stat = os.stat(path)
+        return hashlib.sha1(repr((path, stat.st_size, stat.st_mtime))).hexdigest()
+
+    def get(self, filename):
+        """cached audio of ``filename``
+
+        :param filename: name of audio file
+        :return: data, duration, channels, samplerate or None if not cached
+        """
+        key = self._key(filename)
+        samples_file = os.path.join(self.directory, key+".npy")
+        info_file = os.path.join(self.directory, key+".json")
+        try:
+            f = open(info_file)
+            try:
+                info = json.load(f)
+            finally:
+                f.close()
+            data = numpy.load(samples_file, mmap_mode='r')
+        except (IOError, ValueError):
+            return None
+
+        # mark as recently used
+        os.utime(samples_file, None)
+        log.debug("Audio cache hit for "+filename)
+        return data, info['duration'], info['channels'], info['samplerate']
+
+    def put(self, filename, data, duration, channels, samplerate):
+        """store decoded audio of ``filename`` and remove the least
+        recently used entries if the cache is too large
+
+        :param filename: name of audio file
+        :param data: decoded samples, not cached if larger than ``max_bytes``
+        """
+        data = numpy.asarray(data)
+        if data.nbytes > self.max_bytes:
+            log.debug("Audio cache too small for "+filename)
+            return
+        key = self._key(filename)
+        info = {'filename': os.path.abspath(filename), 'duration': duration,
+                'channels': channels, 'samplerate': samplerate}
+
+        # write to temporary files first, so other processes never
+        # read half written entries
+        for extension, write in ((".npy", lambda f: numpy.save(f, data)),
+                                 (".json", lambda f: json.dump(info, f))):
+            handle, temporary = tempfile.mkstemp(dir=self.directory)
+            f = os.fdopen(handle, 'wb')
+            try:
+                write(f)
+            finally:
+                f.close()
+            os.rename(temporary, os.path.join(self.directory, key+extension))
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """remove least recently used entries until the
+        cache is smaller than ``max_bytes``
+
+        :param keep: entry that is not removed, like the one just added
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name != str(keep)+".npy":
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            log.debug("Audio cache removes "+path)
+            for remove in (path, path[:-len(".npy")]+".json"):
+                try:
+                    os.remove(remove)
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        """remove all entries"""
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") or name.endswith(".json"):
+                os.remove(os.path.join(self.directory, name))
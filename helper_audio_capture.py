@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Always-on audio capture into a ring buffer
+
+    :platform: Linux
+    :synopsis: Capture Service
+
+``record_at_time`` builds a new GStreamer pipeline for every pairing,
+which adds startup latency exactly when the timing matters. The
+``CaptureService`` records all the time and keeps the last seconds in a
+``RingBuffer`` in shared memory. Every sample has a timestamp, so the
+window of any ``start_time`` can be cut out, also if ``start_time`` is
+slightly in the past. With a ``filename`` other processes read the
+recording with ``RingBuffer.attach``.
+
+The audio comes from a ``MicrophoneSource`` or, for tests, from a
+``FileSource`` that plays a file in real time.
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+from __future__ import with_statement
+import os
+import mmap
+import time
+import threading
+import numpy
+
+from helper_audio import load_mono
+
+import logging
+# get logger
+log = logging.getLogger("fuzzy_pairing")
+
+# header of the ring buffer: written samples, index and time of the
+# last timestamped sample, capacity, samplerate and sequence number
+HEADER_BYTES = 64
+
+
+class RingBuffer(object):
+    """Last ``seconds`` seconds of mono int16 audio with timestamps
+
+    The samples are kept in an mmap, anonymous or in ``filename``
+    (for example in /dev/shm). Other processes read them with
+    ``RingBuffer.attach(filename)``. The writer makes the sequence
+    number odd while it writes, readers retry until they read the same
+    even sequence number before and after copying (a seqlock).
+
+    :param seconds: Length of the buffer in seconds.
+    :param samplerate: Samplerate of the audio.
+    :param filename: Optional file for the shared memory, it is created new.
+    """
+    def __init__(self, seconds, samplerate, filename=None):
+        self.samplerate = samplerate
+        self.capacity = int(seconds * samplerate)
+        self.read_only = False
+        size = HEADER_BYTES + 2*self.capacity
+
+        if filename is None:
+            self.memory = mmap.mmap(-1, size)
+        else:
+            f = open(filename, 'w+b')
+            try:
+                f.truncate(size)
+                self.memory = mmap.mmap(f.fileno(), size)
+            finally:
+                f.close()
+        self._map()
+
+        header = self.header
+        header[5] = 0                   # sequence number, odd while writing
+        header[0] = 0                   # written samples
+        header[1] = -1                  # index of last timestamp
+        self.times[2] = 0.0             # time of last timestamp
+        header[3] = self.capacity
+        header[4] = samplerate
+
+        self.condition = threading.Condition()
+
+    @classmethod
+    def attach(cls, filename):
+        """read only ring buffer in ``filename`` that another process
+        writes, like the ``filename`` of a ``CaptureService``
+
+        :param filename: File of the shared memory.
+        :return: ring -- ``RingBuffer``, ``write`` is not allowed
+        :raise: ValueError if the file is no ring buffer
+        """
+        ring = cls.__new__(cls)
+        f = open(filename, 'rb')
+        try:
+            ring.memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        if len(ring.memory) < HEADER_BYTES:
+            raise ValueError(filename+" is no ring buffer")
+        ring._map()
+        ring.read_only = True
+        ring.capacity = int(ring.header[3])
+        ring.samplerate = int(ring.header[4])
+        if len(ring.memory) != HEADER_BYTES + 2*ring.capacity:
+            raise ValueError(filename+" is no ring buffer of "+str(ring.capacity)+" samples")
+        ring.condition = threading.Condition()
+        return ring
+
+    def _map(self):
+        """numpy views of header and samples in the mmap"""
+        self.header = numpy.frombuffer(self.memory, dtype=numpy.int64, count=HEADER_BYTES/8)
+        self.times = numpy.frombuffer(self.memory, dtype=numpy.float64, count=HEADER_BYTES/8)
+        self.samples = numpy.frombuffer(self.memory, dtype=numpy.int16, offset=HEADER_BYTES)
+
+    def _begin_read(self):
+        """even sequence number, waits while the writer writes"""
+        while True:
+            sequence = int(self.header[5])
+            if sequence % 2 == 0:
+                return sequence
+            time.sleep(0)
+
+    def _changed(self, sequence):
+        """True if the writer wrote since ``_begin_read``"""
+        return int(self.header[5]) != sequence
+
+    @property
+    def written(self):
+        """number of samples written since the start"""
+        return int(self.header[0])
+
+    def write(self, samples, timestamp=None):
+        """append samples, the oldest samples are overwritten
+
+        :param samples: int16 samples
+        :param timestamp: time.time() of the first sample, if known
+        """
+        if self.read_only:
+            raise RuntimeError("Ring buffer is attached read only")
+        samples = numpy.asarray(samples, dtype=numpy.int16)
+        with self.condition:
+            self.header[5] += 1
+            written = self.written
+            if timestamp is not None:
+                self.header[1] = written
+                self.times[2] = timestamp
+
+            # only the last capacity samples fit
+            skipped = max(0, len(samples) - self.capacity)
+            position = (written + skipped) % self.capacity
+            rest = samples[skipped:]
+            first = min(len(rest), self.capacity - position)
+            self.samples[position:position+first] = rest[:first]
+            self.samples[0:len(rest)-first] = rest[first:]
+
+            self.header[0] = written + len(samples)
+            self.header[5] += 1
+            self.condition.notifyAll()
+
+    def index_at(self, at_time):
+        """index of the sample recorded at ``at_time``, counted from
+        the last timestamp"""
+        while True:
+            sequence = self._begin_read()
+            index = int(self.header[1])
+            timestamp = float(self.times[2])
+            if not self._changed(sequence):
+                break
+        if index < 0:
+            raise RuntimeError("No timestamped samples in ring buffer")
+        return index + int(round((at_time - timestamp) * self.samplerate))
+
+    def read(self, start, count):
+        """copy of ``count`` samples from index ``start``
+
+        :raise: ValueError if the samples are overwritten, from before
+                the first sample or not written yet
+        """
+        while True:
+            sequence = self._begin_read()
+            written = self.written
+            if start < max(0, written - self.capacity):
+                raise ValueError("Samples are not in the ring buffer")
+            if start + count > written:
+                raise ValueError("Samples are not recorded yet")
+            position = start % self.capacity
+            first = min(count, self.capacity - position)
+            data = numpy.concatenate((self.samples[position:position+first],
+                                      self.samples[0:count-first]))
+            # samples may be overwritten while copying
+            if not self._changed(sequence):
+                return data
+
+    def get_window(self, start_time, duration, timeout=None):
+        """samples from ``start_time`` on for ``duration`` seconds,
+        waits until they are recorded
+
+        :param start_time: Absolute time of the first sample.
+        :param duration: Length in seconds.
+        :param timeout: Maximal time to wait after the end of the window.
+        :return: data -- int16 numpy array
+        :raise: ValueError if the window is not in the buffer anymore
+        :raise: RuntimeError on timeout
+        """
+        count = int(duration * self.samplerate)
+        deadline = None
+        if timeout is not None:
+            deadline = start_time + duration + timeout
+
+        with self.condition:
+            while True:
+                try:
+                    start = self.index_at(start_time)
+                except RuntimeError:
+                    start = None
+                if start is not None and start + count <= self.written:
+                    return self.read(start, count)
+                if deadline is not None and time.time() > deadline:
+                    raise RuntimeError("Window at "+str(start_time)+" was not recorded in time")
+                # short waits, writers in other processes do not notify
+                self.condition.wait(0.05)
+
+
+class FileSource(object):
+    """Plays a mono file in real time into the ring buffer,
+    stands in for the microphone in tests
+
+    :param filename: Audio file, its samplerate must match the buffer.
+    :param block_seconds: Length of the written blocks.
+    :param loop: Start again at the end of the file.
+    """
+    def __init__(self, filename, block_seconds=0.1, loop=True):
+        self.filename = filename
+        self.block_seconds = block_seconds
+        self.loop = loop
+        self.running = False
+        self.thread = None
+
+    def start(self, ring):
+        data, samplerate = load_mono(self.filename)
+        if samplerate != ring.samplerate:
+            raise ValueError("Samplerate of "+self.filename+" is "+str(samplerate)+", not "+str(ring.samplerate))
+        self.running = True
+        self.thread = threading.Thread(target=self._run, args=(ring, data))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, ring, data):
+        block = max(1, int(self.block_seconds * ring.samplerate))
+        start_time = time.time()
+        played = 0
+        while self.running:
+            position = played % len(data)
+            if not self.loop and played >= len(data):
+                break
+            samples = data[position:position+block]
+            # the block is written when its last sample was "recorded"
+            ready = start_time + float(played + len(samples)) / ring.samplerate
+            time.sleep(max(0, ready - time.time()))
+            ring.write(samples, start_time + float(played) / ring.samplerate)
+            played += len(samples)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+
+class MicrophoneSource(object):
+    """Records the default microphone with GStreamer into the
+    ring buffer, timestamps come from the GStreamer buffers
+    """
+    def __init__(self):
+        self.pipeline = None
+        self.clock_offset = None
+
+    def start(self, ring):
+        import pygst
+        pygst.require("0.10")
+        import gst
+        self.gst = gst
+
+        self.pipeline = gst.parse_launch(
+            "autoaudiosrc ! audioconvert ! audioresample ! "
+            "audio/x-raw-int, endianness=byte_order, signed=(boolean)true, width=16, depth=16, "
+            "rate="+str(ring.samplerate)+", channels=1 ! "
+            "appsink name=sink drop=false sync=false emit-signals=true")
+        sink = self.pipeline.get_by_name("sink")
+        sink.connect("new-buffer", self._new_buffer, ring)
+
+        self.pipeline.set_state(gst.STATE_PLAYING)
+        # offset between the pipeline clock and the wall clock
+        clock = self.pipeline.get_clock()
+        if clock is not None:
+            self.clock_offset = time.time() - float(clock.get_time()) / gst.SECOND
+
+    def _new_buffer(self, sink, ring):
+        gst = self.gst
+        buf = sink.emit('pull-buffer')
+        timestamp = None
+        if self.clock_offset is not None and buf.timestamp != gst.CLOCK_TIME_NONE:
+            # buffer timestamps are running time of the pipeline
+            timestamp = float(self.pipeline.get_base_time() + buf.timestamp) / gst.SECOND + self.clock_offset
+        ring.write(numpy.frombuffer(str(buf), dtype=numpy.int16), timestamp)
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.set_state(self.gst.STATE_NULL)
+            self.pipeline = None
+
+
+class CaptureService(object):
+    """Records all the time and keeps the last ``seconds`` seconds
+
+    >>> service = CaptureService(MicrophoneSource()).start()
+    >>> data, samplerate = service.get_window(time.time()-7, 7)
+
+    :param source: ``MicrophoneSource`` or ``FileSource``
+    :param seconds: Length of the ring buffer in seconds.
+    :param samplerate: Samplerate of the recording.
+    :param filename: Optional file for the shared memory of the ring buffer.
+    """
+    def __init__(self, source, seconds=30, samplerate=44100, filename=None):
+        self.source = source
+        self.ring = RingBuffer(seconds, samplerate, filename)
+
+    def start(self):
+        self.source.start(self.ring)
+        log.info("Capture service started")
+        return self
+
+    def stop(self):
+        self.source.stop()
+        log.info("Capture service stopped")
+
+    def get_window(self, start_time, duration, timeout=2.0):
+        """recording from ``start_time`` on, see ``RingBuffer.get_window``
+
+        :return: data -- int16 numpy array
+        :return: samplerate -- Samplerate of data
+        """
+        data = self.ring.get_window(start_time, duration, timeout)
+        return data, self.ring.samplerate
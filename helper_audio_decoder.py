@@ -59,9 +59,12 @@ import os
 import urllib
 import Queue
 
-import scipy
-import struct
+import numpy
+import math
 
+# Buffers waiting in our queue and in the appsink. Together with the
+# buffer size of the decoder they bound the memory used for a file,
+# larger values let the decoder run further ahead of the consumer.
 QUEUE_SIZE = 10
 BUFFER_SIZE = 10
 SENTINEL = '__GSTDEC_SENTINEL__'
@@ -155,12 +158,15 @@ knows how to decode.
 Iterating the object yields blocks of 16-bit PCM data. Three
 pieces of stream information are also available: samplerate (in Hz),
 number of channels, and duration (in nanoseconds).
+blocks() yields the data as numpy arrays of a fixed number of frames.
+queue_size and buffer_size bound the number of decoded buffers
+waiting for the consumer.
 It's very important that the client call close() when it's done
 with the object. Otherwise, the program is likely to hang on exit.
 Alternatively, of course, one can just use the file as a context
 manager, as shown above.
 """
-    def __init__(self, path):
+    def __init__(self, path, queue_size=QUEUE_SIZE, buffer_size=BUFFER_SIZE):
         self.running = False
         
         # Set up the Gstreamer pipeline.
@@ -197,7 +203,7 @@ manager, as shown above.
         # behavior in which you consume buffers in real time. This way,
         # we get data as soon as it's decoded.
         self.sink.set_property('drop', False)
-        self.sink.set_property('max-buffers', BUFFER_SIZE)
+        self.sink.set_property('max-buffers', buffer_size)
         self.sink.set_property('sync', False)
         # The callback to receive decoded data.
         self.sink.set_property('emit-signals', True)
@@ -219,7 +225,7 @@ manager, as shown above.
         self.conv.link(self.sink)
         
         # Set up the queue for data and run the main thread.
-        self.queue = Queue.Queue(QUEUE_SIZE)
+        self.queue = Queue.Queue(queue_size)
         self.thread = get_loop_thread()
         
         # This wil get filled with an exception if opening fails.
@@ -325,6 +331,64 @@ manager, as shown above.
     def __iter__(self):
         return self
     
+    def blocks(self, block_size=4096, overlap=0, mono=False):
+        """Yield the data as int16 numpy arrays of ``block_size``
+        frames, the last block may be shorter.
+        
+        Every block starts ``block_size - overlap`` frames after the
+        previous one, so the last ``overlap`` frames are repeated at
+        the start of the next block. Stereo blocks have the shape
+        (channels, frames) like read_as_array, with ``mono`` the
+        channels are averaged. Only the current block and the queued
+        buffers are held in memory.
+        """
+        if not 0 <= overlap < block_size:
+            raise ValueError("overlap must be smaller than block_size")
+        channels = self.channels
+        frame_bytes = 2 * channels
+        overlap_samples = overlap * channels
+        
+        block = numpy.empty(block_size * channels, dtype=numpy.int16)
+        filled = 0
+        # samples in block that were not yielded yet
+        new = 0
+        rest = ''
+        for s in self:
+            # buffers may end within a frame, keep the rest for the next one
+            if rest:
+                s = rest + s
+            usable = len(s) - len(s) % frame_bytes
+            rest = s[usable:]
+            samples = numpy.frombuffer(s, dtype=numpy.int16, count=usable / 2)
+            
+            position = 0
+            while position < len(samples):
+                take = min(len(block) - filled, len(samples) - position)
+                block[filled:filled+take] = samples[position:position+take]
+                filled += take
+                new += take
+                position += take
+                if filled == len(block):
+                    yield self._shape_block(block, mono)
+                    # new array, so yielded blocks stay valid
+                    following = numpy.empty_like(block)
+                    following[:overlap_samples] = block[len(block)-overlap_samples:]
+                    block = following
+                    filled = overlap_samples
+                    new = 0
+        
+        if new > 0:
+            yield self._shape_block(block[:filled], mono)
+    
+    def _shape_block(self, block, mono):
+        # interleaved samples, every channel is a strided view
+        if self.channels == 1:
+            return block
+        frames = block.reshape(-1, self.channels)
+        if mono:
+            return (frames.sum(axis=1, dtype=numpy.int32) / self.channels).astype(numpy.int16)
+        return frames.T
+    
     # Cleanup.
     def close(self):
         if self.running:
@@ -362,8 +426,13 @@ manager, as shown above.
 def read_as_array(filename):
     """reads audio file as scipy array using gstreamer framework
     
+    The decoded buffers are copied with numpy.frombuffer into one
+    preallocated int16 array, sized from duration and samplerate and
+    grown if the duration was too short. Stereo channels are strided
+    views on this array, no copies.
+    
     return:
-        data as scipy array
+        data as scipy array of int16, shape (channels, samples) for stereo
         duration in seconds
         channels as int
         samplerate
@@ -371,30 +440,129 @@ def read_as_array(filename):
     path = os.path.abspath(os.path.expanduser(filename))
     with GstAudioFile(path) as f:
         samplerate = f.samplerate
-        duration = float(f.duration) / 1000000000 # in seconds
         channels = f.channels
+        if f.duration is None:
+            # unknown duration, start with one second and grow
+            duration = None
+            size = samplerate * channels
+        else:
+            duration = float(f.duration) / 1000000000 # in seconds
+            size = int(math.ceil(duration * samplerate)) * channels
         
-        data_left = []
-        data_right = []
-        data_mono = []
+        # native endianness like the 16 bit samples from gstreamer
+        samples = numpy.empty(max(size, 1), dtype=numpy.int16)
+        length = 0
         for s in f:
-            # http://docs.python.org/library/struct.html
-            # little or big endian is choosen automatically by python
-            # if its stereo (2 channels): first one is left channel, second is right channel, third is left channel...
-            # every short (h) is 2 bytes long and padding on stereo with two x (xx) for other channel
-            if channels == 1:
-                data_mono += list(struct.unpack( ("h"*(len(s)/2)), s))
-            elif channels == 2:
-                data_left += list(struct.unpack( ("hxx"*(len(s)/4)), s))
-                data_right += list(struct.unpack( ("xxh"*(len(s)/4)), s))
+            block = numpy.frombuffer(s, dtype=numpy.int16)
+            if length + len(block) > len(samples):
+                # duration was too short, grow at least by factor 2
+                grown = numpy.empty(max(2*len(samples), length+len(block)), dtype=numpy.int16)
+                grown[:length] = samples[:length]
+                samples = grown
+            samples[length:length+len(block)] = block
+            length += len(block)
         
+        # if its stereo (2 channels): first one is left channel, second is right channel, third is left channel...
+        # so every channel is a view with stride of one frame
+        samples = samples[:length - length % channels]
         if channels == 1:
-            data = scipy.array(data_mono)
-        elif channels == 2:
-            data = scipy.array([data_left, data_right])
+            data = samples
+        else:
+            data = samples.reshape(-1, channels).T
+        
+        if duration is None:
+            duration = float(len(samples)) / channels / samplerate
         
     return data, duration, channels, samplerate
 
+def read_as_blocks(filename, block_size=4096, overlap=0, mono=False, queue_size=QUEUE_SIZE, buffer_size=BUFFER_SIZE):
+    """reads audio file block by block using gstreamer framework,
+    see GstAudioFile.blocks
+    
+    The file is closed when the generator is exhausted or closed.
+    
+    return:
+        samplerate
+        channels as int
+        generator of int16 numpy arrays with block_size frames
+    """
+    path = os.path.abspath(os.path.expanduser(filename))
+    f = GstAudioFile(path, queue_size, buffer_size)
+    
+    def generate():
+        try:
+            for block in f.blocks(block_size, overlap, mono):
+                yield block
+        finally:
+            f.close()
+    
+    return f.samplerate, f.channels, generate()
+
+def decode_files(filenames, workers=4, read=None):
+    """decodes many audio files concurrently
+    
+    Every worker thread runs its own pipeline on the shared main loop,
+    so up to ``workers`` files are decoded at the same time. Results
+    are yielded in the order the files are finished. At most
+    ``workers`` finished results wait for the consumer.
+    
+    filenames:
+        iterable of audio files
+    workers:
+        number of files decoded at the same time
+    read:
+        function decoding one file, default is read_as_array
+    
+    return:
+        generator of (filename, result, error), result is the return
+        value of read or None if read raised error
+    """
+    if read is None:
+        read = read_as_array
+    
+    tasks = Queue.Queue()
+    for filename in filenames:
+        tasks.put(filename)
+    results = Queue.Queue(workers)
+    stop = threading.Event()
+    done = object()
+    
+    def work():
+        while not stop.isSet():
+            try:
+                filename = tasks.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                result = read(filename)
+            except Exception, err:
+                results.put((filename, None, err))
+            else:
+                results.put((filename, result, None))
+        results.put(done)
+    
+    running = 0
+    for i in range(workers):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        running += 1
+    
+    try:
+        while running:
+            item = results.get()
+            if item is done:
+                running -= 1
+            else:
+                yield item
+    finally:
+        # consumer stopped early, let the workers finish their
+        # current file and take no new ones
+        stop.set()
+        while running:
+            if results.get() is done:
+                running -= 1
+
 # Test
 if __name__ == '__main__':
     data, duration, channels, samplerate = read_as_array("test.flac")
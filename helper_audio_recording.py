@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from __future__ import with_statement
 import time
 import thread
 import gobject
@@ -7,26 +8,119 @@ pygst.require("0.10")
 import gst
 
 import os
+import threading
+import numpy
+from scipy.io import wavfile
 
 from helper_audio import load_mono
+from fingerprint_energy_diff import get_required_samples
 
 import logging
 # get logger
 log = logging.getLogger("fuzzy_pairing")
 
+# the last seconds before a deadline are waited actively,
+# sleeping is not precise enough for them
+SPIN_TIME = 0.002
+
+# the server searches time shifts of up to 175*100 samples, data
+# beyond the fingerprint keeps shifted fingerprints from zeros
+ALIGNMENT_MARGIN = 175*100 / 44100.0
+
+# time GStreamer may need to deliver the first samples
+STARTUP_SLACK = 1.0
+
+def get_recording_duration(samplerate=44100, margin=ALIGNMENT_MARGIN):
+    """
+    Seconds of audio needed for a fingerprint plus the alignment margin.
+    """
+    return float(get_required_samples(samplerate)) / samplerate + margin
+
+def rms_gate(min_rms):
+    """
+    Quality gate for record_at_time, accepts recordings
+    with a root mean square of at least min_rms.
+    """
+    def gate(data, samplerate):
+        return numpy.sqrt(numpy.mean(numpy.square(data, dtype=numpy.float64))) >= min_rms
+    return gate
+
+def sleep_until(deadline, event=None):
+    """
+    Sleep until time.time() reaches deadline, only the last SPIN_TIME
+    seconds are waited actively. Returns early if event is set.
+    """
+    while True:
+        remaining = deadline - time.time() - SPIN_TIME
+        if remaining <= 0:
+            break
+        if event is None:
+            time.sleep(remaining)
+        elif event.wait(remaining) or event.isSet():
+            return
+    while time.time() < deadline:
+        if event is not None and event.isSet():
+            return
+
+def align_to_start(data, samplerate, capture_start_time, start_time):
+    """
+    Samples of data from start_time on. The first sample was captured
+    at capture_start_time: samples before start_time are dropped, a
+    late start is padded with zeros, so recordings of both devices
+    start at the same time. Delays of more than STARTUP_SLACK seconds
+    come from a wrong clock offset and are not aligned.
+    """
+    delay = capture_start_time - start_time
+    if abs(delay) > STARTUP_SLACK:
+        log.error("Recording not aligned, first sample "+str(delay)+" seconds after start time")
+        return data
+    
+    offset = int(round(delay*samplerate))
+    log.debug("Recording aligned by "+str(offset)+" samples")
+    if offset > 0:
+        return numpy.concatenate((numpy.zeros(offset, dtype=data.dtype), data))
+    return data[-offset:]
+
 class AudioRecording:
     """
     Simple audio recorder that records the input audio
-    and saves it as an MP3 audio file.
+    and saves it as an WAV audio file.
     (for example audio input from a microphone)
+    
+    With in_memory the samples are captured by an appsink into a
+    preallocated numpy array instead, see get_data and save. The
+    recording stops as soon as duration seconds are captured and
+    quality_gate(data, samplerate) accepts them, or max_duration
+    seconds are captured.
     """
-    def __init__(self, filename, duration):
+    def __init__(self, filename, duration, in_memory=False, samplerate=44100, quality_gate=None, max_duration=None):
         self.is_playing = False
         self.num_buffers = -1
         self.error_message = ""
         
         self.filename = filename
         self.duration = duration
+        self.in_memory = in_memory
+        self.samplerate = samplerate
+        
+        # buffer for in memory capture, grows if the recording takes longer
+        self.data = numpy.empty(int(duration*samplerate), dtype=numpy.int16)
+        self.data_length = 0
+        self.data_lock = threading.Lock()
+        
+        # early stop of in memory capture
+        self.required_samples = int(duration*samplerate)
+        self.max_samples = int(max(duration, max_duration or 0)*samplerate)
+        self.quality_gate = quality_gate
+        self.enough = threading.Event()
+        
+        # wall clock time of the first captured sample, from the
+        # GStreamer buffer timestamps
+        self.capture_start_time = None
+        self.clock_offset = None
+        
+        # set when the pipeline stopped
+        self.stopped = threading.Event()
         
         self.constructPipeline()
         self.connectSignals()
@@ -45,35 +139,81 @@ class AudioRecording:
         self.audioresample = gst.element_factory_make('audioresample')
         
         # set capsfilter
-        outcaps = gst.Caps("audio/x-raw-int, endianness=byte_order, signed=(boolean)true, width=16, depth=16, rate=44100, channels=1")
+        outcaps = gst.Caps("audio/x-raw-int, endianness=byte_order, signed=(boolean)true, width=16, depth=16, rate="+str(self.samplerate)+", channels=1")
         self.capsfilter = gst.element_factory_make("capsfilter") 
         self.capsfilter.props.caps = outcaps
 
-        # encoder
-        self.encoder = gst.element_factory_make("wavenc")
-        
-        # filesink
-        self.filesink = gst.element_factory_make("filesink")
-        self.filesink.set_property("location", self.filename)
+        if self.in_memory:
+            # appsink hands the raw samples to _new_buffer
+            self.appsink = gst.element_factory_make("appsink")
+            self.appsink.set_property("drop", False)
+            self.appsink.set_property("sync", False)
+            self.appsink.set_property("emit-signals", True)
+            self.appsink.connect("new-buffer", self._new_buffer)
+            sinks = [self.appsink]
+        else:
+            # encoder
+            self.encoder = gst.element_factory_make("wavenc")
+            
+            # filesink
+            self.filesink = gst.element_factory_make("filesink")
+            self.filesink.set_property("location", self.filename)
+            sinks = [self.encoder, self.filesink]
 
+        elements = [self.audiosrc,
+                    self.audiorate,
+                    self.audioconvert,
+                    self.audioresample,
+                    self.capsfilter] + sinks
 
         # Add elements to the pipeline
-        self.recorder.add(self.audiosrc,
-                        self.audiorate,
-                        self.audioconvert,
-                        self.audioresample,
-                        self.capsfilter,
-                        self.encoder,
-                        self.filesink)
+        self.recorder.add(*elements)
 
         # Link elements in the pipeline.
-        gst.element_link_many(self.audiosrc,
-                              self.audiorate,
-                              self.audioconvert,
-                              self.audioresample,
-                              self.capsfilter,
-                              self.encoder,
-                              self.filesink)
+        gst.element_link_many(*elements)
+
+    def _new_buffer(self, sink):
+        """
+        Copy captured samples into the numpy buffer.
+        """
+        buf = sink.emit('pull-buffer')
+        if self.capture_start_time is None and self.clock_offset is not None and buf.timestamp != gst.CLOCK_TIME_NONE:
+            # buffer timestamps are running time of the pipeline
+            self.capture_start_time = float(self.recorder.get_base_time() + buf.timestamp) / gst.SECOND + self.clock_offset
+        samples = numpy.frombuffer(str(buf), dtype=numpy.int16)
+        with self.data_lock:
+            end = self.data_length + len(samples)
+            if end > len(self.data):
+                grown = numpy.empty(max(end, 2*len(self.data)), dtype=numpy.int16)
+                grown[:self.data_length] = self.data[:self.data_length]
+                self.data = grown
+            self.data[self.data_length:end] = samples
+            self.data_length = end
+        
+        if end >= self.required_samples and not self.enough.isSet():
+            if end >= self.max_samples or self.quality_gate is None or self.quality_gate(self.get_data(), self.samplerate):
+                log.debug("Recording has enough samples: "+str(end))
+                self.enough.set()
+
+    def get_data(self):
+        """
+        Samples captured in memory until now
+        """
+        with self.data_lock:
+            return self.data[:self.data_length]
+
+    def save(self, filename=None, data=None):
+        """
+        Write the samples captured in memory, or data like the aligned
+        samples, to a WAV file in a background thread, returns the thread.
+        """
+        if filename is None:
+            filename = self.filename
+        if data is None:
+            data = self.get_data()
+        writer = threading.Thread(target=wavfile.write, args=(filename, self.samplerate, data))
+        writer.start()
+        return writer
 
     def connectSignals(self):
         """
@@ -94,13 +234,21 @@ class AudioRecording:
         self.is_playing = True
         self.recorder.set_state(gst.STATE_PLAYING)
         log.debug("Recording GStreamer started at "+str(time.time()))
-        # record until end_time
-        while self.is_playing:
-            if (time.time() >= end_time):
-                # stop recording
-                self.record_stop()
-                
-                break
+        
+        # offset between the pipeline clock and the wall clock
+        clock = self.recorder.get_clock()
+        if clock is not None:
+            self.clock_offset = time.time() - float(clock.get_time()) / gst.SECOND
+        
+        if self.in_memory:
+            # record until enough samples are captured,
+            # end_time is only the deadline
+            sleep_until(end_time, self.enough)
+        else:
+            # record until end_time, errors stop earlier
+            sleep_until(end_time, self.stopped)
+        if self.is_playing:
+            self.record_stop()
 
     def record_stop(self):
         """
@@ -108,7 +256,11 @@ class AudioRecording:
         """
         self.recorder.set_state(gst.STATE_NULL)
         self.is_playing = False
+        self.stopped.set()
+        self.enough.set()
         log.debug("Recording stopped at "+str(time.time()))
+        if self.capture_start_time is not None:
+            log.debug("Recording first sample at "+str(self.capture_start_time))
         
         # error messages?
         if self.error_message:
@@ -124,25 +276,43 @@ class AudioRecording:
             self.recorder.set_state(gst.STATE_NULL)
             self.is_playing = False
             self.error_message =  message.parse_error()
+            self.stopped.set()
+            self.enough.set()
         elif msgType == gst.MESSAGE_EOS:
             self.recorder.set_state(gst.STATE_NULL)
             self.is_playing = False
+            self.stopped.set()
+            self.enough.set()
 
 
-def record_at_time(filename, duration, start_time):
+def record_at_time(filename, duration, start_time, in_memory=True, quality_gate=None, max_duration=None):
+    """
+    Record ``duration`` seconds from start_time on, see
+    get_recording_duration for the duration a fingerprint needs.
+    
+    With in_memory the samples are captured directly into a numpy
+    array, the file is written in the background afterwards (no file
+    if filename is None). The recording stops as soon as duration
+    seconds of samples are captured. If quality_gate (like rms_gate)
+    rejects them, it goes on up to max_duration seconds. The samples
+    are aligned to start_time with the timestamp of the first buffer,
+    see align_to_start. Otherwise the recording is written to filename
+    and loaded again.
+    """
     # init recorder
-    recording = AudioRecording(filename, duration)
+    recording = AudioRecording(filename, duration, in_memory, quality_gate=quality_gate, max_duration=max_duration)
     
-    end_time = start_time+duration
+    if in_memory:
+        # deadline only, the samples decide when to stop
+        end_time = start_time+max(duration, max_duration or 0)+STARTUP_SLACK
+    else:
+        end_time = start_time+duration
     
     log.debug("Recording Start time: "+str(start_time))
     log.debug("Recording End time: "+str(end_time))
     
     # starting at start_time
-    while True:
-        if (time.time() >= start_time):
-            # now go on!
-            break
+    sleep_until(start_time)
 
     log.info('Recording thread started at '+str(time.time()))
     
@@ -153,20 +323,31 @@ def record_at_time(filename, duration, start_time):
     # init and start gobject c threads
     loop = gobject.MainLoop()
     gobject.threads_init()
-    context = loop.get_context()
     
-    # record and do thread loop until end_time
-    while True:
-        # do gobject iteration
-        context.iteration(True)
-        
-        if (time.time() >= end_time):
-            # terminate gobject thread
+    # handle bus messages until the recording stopped
+    def check_stopped():
+        if recording.stopped.isSet():
             loop.quit()
-            
-            break
+            return False
+        return True
+    gobject.timeout_add(10, check_stopped)
+    loop.run()
+    
+    # wait for the pipeline to stop, no more samples after that
+    recording.stopped.wait()
+    
+    if in_memory:
+        data = recording.get_data()
+        if recording.capture_start_time is not None:
+            log.debug("Recording latency: "+str(recording.capture_start_time - start_time)+" seconds")
+            data = align_to_start(data, recording.samplerate, recording.capture_start_time, start_time)
+        
+        if filename is not None:
+            recording.save(filename, data)
+        
+        return data, recording.samplerate
     
     # load recorded file
     recording_data, recording_samplerate = load_mono(filename)
     
-    return recording_data, recording_samplerate
\ No newline at end of file
+    return recording_data, recording_samplerate
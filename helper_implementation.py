@@ -7,8 +7,11 @@
 .. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
 
 """
+from __future__ import with_statement
 import scipy
 import logging
+import threading
+from itertools import combinations
 # get logger
 log = logging.getLogger("fuzzy_pairing")
 import fingerprint_energy_diff
@@ -58,48 +61,266 @@ def generate_key_for_aes(codeword):
     
     return key_string
     
-def move_data_right(data, steps):
+def move_data_right(data, steps, chunk=100):
     """move data to the right and fill rest with zeros
     
     :param data: chunks of data
     :param steps: steps to move
     :type steps: int
+    :param chunk: length of one step
     :return: data
     """
-    number = steps*100
+    number = steps*chunk
     data = scipy.hstack(([0]*number, data[0:-number]))
     return data
     
-def move_data_left(data, steps):
+def move_data_left(data, steps, chunk=100):
     """move data to the left and fill rest with zeros
     
     :param data: chunks of data
     :param steps: steps to move
     :type steps: int
+    :param chunk: length of one step
     :return: data
     """
-    number = steps*100
+    number = steps*chunk
     data = scipy.hstack((data[number:], [0]*number))
     return data
     
-def get_possible_fingerprints(recording_data, recording_samplerate):
+def get_possible_fingerprints(recording_data, recording_samplerate, fingerprint_rate=None):
     """generate many fingerprints varying in time
     
     :param recording_data: complete recording data
     :param recording_samplerate: samplerate of recording
+    :param fingerprint_rate: samplerate for fingerprinting, see ``fingerprint_energy_diff.calculate_fingerprint``
     :return: many fingerprints
     """
-    fingerprint = fingerprint_energy_diff.get_fingerprint(recording_data, recording_samplerate)
-    possible_fingerprints = [fingerprint]
     # correct 0,20 seconds in time (0,20*44100=~8800) -> 88*100 data chunks!
-    n = 176 # -> 0,4 seconds
+    # n = 176 -> 0,4 seconds
+    possible_fingerprints = []
+    for shift, fingerprint in iter_shifted_fingerprints(recording_data, recording_samplerate, n=176, fingerprint_rate=fingerprint_rate):
+        possible_fingerprints += [fingerprint]
+
+    return possible_fingerprints
+
+
+def iter_shifted_fingerprints(recording_data, recording_samplerate, n=176, fingerprint=None, fingerprint_rate=None):
+    """generate fingerprints varying in time, one by one
+    
+    Yields the fingerprint of the unshifted data first, then
+    alternately data moved left and right by growing steps of
+    100 data chunks.
+    
+    With ``fingerprint_rate`` the recording is decimated only once and
+    moved at the fingerprint rate, a step is then as close to 100 data
+    chunks of the recording as possible.
+    
+    :param recording_data: complete recording data
+    :param recording_samplerate: samplerate of recording
+    :param n: number of steps in every direction + 1
+    :param fingerprint: unshifted fingerprint, if already calculated
+    :param fingerprint_rate: samplerate for fingerprinting, see ``fingerprint_energy_diff.calculate_fingerprint``
+    :return: generator of (shift in data chunks of the recording, fingerprint)
+    """
+    chunk = 100
+    shift = 100
+    if fingerprint_rate is not None:
+        recording_data, rate = fingerprint_energy_diff.resample(recording_data, recording_samplerate, fingerprint_rate)
+        chunk = max(1, int(round(100 * rate / recording_samplerate)))
+        shift = chunk * recording_samplerate / rate
+        
+    def get_fingerprint(data):
+        if fingerprint_rate is None:
+            return fingerprint_energy_diff.get_fingerprint(data, recording_samplerate)
+        # data is already at the fingerprint rate
+        return fingerprint_energy_diff.get_fingerprint(data, rate, fingerprint_rate=rate)
+    
+    if fingerprint is None:
+        fingerprint = get_fingerprint(recording_data)
+    yield 0, fingerprint
     for i in range(1, n):
         log.debug('Generating possible fingerprint '+str(i)+' of '+str(n))
         # move 100 data chunks to left and build fingerprint
-        data_left = move_data_left(recording_data, i)
-        possible_fingerprints += [fingerprint_energy_diff.get_fingerprint(data_left, recording_samplerate)]
+        data_left = move_data_left(recording_data, i, chunk)
+        yield -int(round(i*shift)), get_fingerprint(data_left)
         # move 100 data chunks to right and build fingerprint
-        data_right = move_data_right(recording_data, i)
-        possible_fingerprints += [fingerprint_energy_diff.get_fingerprint(data_right, recording_samplerate)]
+        data_right = move_data_right(recording_data, i, chunk)
+        yield int(round(i*shift)), get_fingerprint(data_right)
+        
+def iter_chase_fingerprints(fingerprint, reliability, positions=7):
+    """generate fingerprints with flipped unreliable bits
+    
+    Chase-2 like: the ``positions`` least reliable bits are flipped in
+    every possible combination, combinations with less flips first.
+    Wrong bits are often among the unreliable ones, so a fingerprint
+    a few bits beyond the correction radius of the Reed-Solomon-Code
+    can be brought back inside it.
+    
+    :param fingerprint: fingerprint to flip bits in
+    :param reliability: reliability of every bit in ``fingerprint``
+    :param positions: number of least reliable bits that are flipped
+    :return: generator of (flipped positions, fingerprint)
+    """
+    least_reliable = scipy.argsort(reliability, kind='mergesort')[0:positions].tolist()
+    for flips in range(1, len(least_reliable)+1):
+        for flipped in combinations(least_reliable, flips):
+            candidate = fingerprint.copy()
+            candidate[list(flipped)] = 1 - candidate[list(flipped)]
+            yield sorted(flipped), candidate
 
-    return possible_fingerprints
+def get_candidate_fingerprints(recording_data, recording_samplerate, fingerprint=None, reliability=None, budget=351, chase_share=0.2, chase_positions=7, fingerprint_rate=None, unshifted=True):
+    """generate candidate fingerprints from time shifts and
+    flipped unreliable bits
+    
+    Both strategies share a budget of candidates. Time shifts are
+    expensive, because every shift needs a new fingerprint, flipping
+    bits is cheap. After the unshifted fingerprint the strategies are
+    mixed, so that about ``chase_share`` of the candidates come from
+    flipped bits (see ``iter_chase_fingerprints``) and the others from
+    time shifts (see ``iter_shifted_fingerprints``). If one strategy
+    runs out of candidates, the other one gets the rest of the budget.
+    
+    :param recording_data: complete recording data
+    :param recording_samplerate: samplerate of recording
+    :param fingerprint: unshifted fingerprint, if already calculated
+    :param reliability: reliability of every bit in ``fingerprint``, flipping bits is only possible with it
+    :param budget: maximal number of candidates
+    :param chase_share: share of candidates with flipped bits
+    :param chase_positions: number of least reliable bits that are flipped
+    :param fingerprint_rate: samplerate for fingerprinting, see ``fingerprint_energy_diff.calculate_fingerprint``
+    :param unshifted: yield the unshifted fingerprint first, False if it was already tried
+    :return: generator of (strategy, parameter, fingerprint), strategy is 'shift' with shift in data chunks as parameter or 'chase' with flipped positions as parameter
+    """
+    shifted = iter_shifted_fingerprints(recording_data, recording_samplerate, fingerprint=fingerprint, fingerprint_rate=fingerprint_rate)
+    shift, fingerprint = shifted.next()
+    if unshifted:
+        yield 'shift', 0, fingerprint
+    
+    if reliability is None:
+        chase = iter([])
+    else:
+        chase = iter_chase_fingerprints(fingerprint, reliability, chase_positions)
+    
+    strategies = {'shift': shifted, 'chase': chase}
+    emitted = {'shift': int(unshifted), 'chase': 0}
+    total = emitted['shift']
+    while total < budget and strategies:
+        # take the strategy that is most behind its share
+        if 'chase' in strategies and ('shift' not in strategies or emitted['chase'] < chase_share*total):
+            strategy = 'chase'
+        else:
+            strategy = 'shift'
+        try:
+            parameter, candidate = strategies[strategy].next()
+        except StopIteration:
+            del strategies[strategy]
+            continue
+        emitted[strategy] += 1
+        total += 1
+        yield strategy, parameter, candidate
+
+class BackgroundCandidates(object):
+    """candidates of a generator like ``get_candidate_fingerprints``,
+    generated in the background
+    
+    The server starts it right after recording, while the client still
+    commits. Iterating yields the candidates that are ready and waits
+    for the others, so the agreement continues lazily where the
+    generation is. Every iteration starts again at the first candidate.
+    
+    In a thread pool every task generates one candidate and queues the
+    next task, so agreements in the same pool do not wait for all
+    candidates. An iteration generates the next candidate itself if no
+    task is generating it, the task waits for it meanwhile.
+    
+    :param candidates: generator of candidates
+    """
+    def __init__(self, candidates):
+        self.candidates = candidates
+        self.ready = []
+        self.done = False
+        self.error = None
+        self.stopped = False
+        self.generating = False
+        self.condition = threading.Condition()
+        
+    def start(self, pool=None):
+        """start generating
+        
+        :param pool: ``ThreadPool`` to generate in, like the agreement
+                     pool of the server, an own thread if None
+        """
+        if pool is not None:
+            pool.callInThread(self._run_task, pool)
+        else:
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+        return self
+        
+    def _run(self):
+        while self._step():
+            pass
+    
+    def _run_task(self, pool):
+        if self._step():
+            pool.callInThread(self._run_task, pool)
+            
+    def _step(self):
+        """generate the next candidate, waits while an iteration
+        generates one
+        
+        :return: False if all candidates are generated or stopped
+        """
+        with self.condition:
+            while self.generating and not self.done and not self.stopped:
+                self.condition.wait()
+            if self.done or self.stopped:
+                return False
+            self.generating = True
+        try:
+            candidate = self.candidates.next()
+        except StopIteration:
+            return self._finish(None)
+        except Exception, err:
+            log.error('Generating candidates failed: %s' % str(err))
+            return self._finish(err)
+        with self.condition:
+            self.generating = False
+            self.ready.append(candidate)
+            self.condition.notifyAll()
+        return True
+        
+    def _finish(self, error):
+        with self.condition:
+            self.generating = False
+            self.error = error
+            self.done = True
+            self.condition.notifyAll()
+        return False
+            
+    def stop(self):
+        """stop generating, the candidates ready until now stay"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notifyAll()
+        
+    def __iter__(self):
+        i = 0
+        while True:
+            with self.condition:
+                while i >= len(self.ready) and not self.done and not self.stopped and self.generating:
+                    self.condition.wait()
+                ready = i < len(self.ready)
+                if ready:
+                    candidate = self.ready[i]
+                elif self.done or self.stopped:
+                    if self.error is not None:
+                        raise self.error
+                    return
+            if not ready:
+                # no task generates the next candidate right now
+                self._step()
+                continue
+            i += 1
+            yield candidate
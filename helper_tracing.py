@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Latency tracing of the pairing protocol
+
+    :platform: Linux
+    :synopsis: Tracing
+
+Client and server record a span for every protocol step and for the
+internal stages (recording, fingerprinting, commit, candidate
+generation and every decode). A span has the wall clock time of its
+start and its duration from a monotonic clock, so spans of both devices
+can be put side by side while the durations are not disturbed by clock
+adjustments. Spans of one pairing share the pairing id the client sends
+with the connection request.
+
+Tracing is off by default, ``enable_tracing`` writes the spans as JSON
+lines. Run this module on such a file for a summary per stage::
+
+    python helper_tracing.py client_trace.jsonl server_trace.jsonl
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+from __future__ import with_statement
+import os
+import json
+import time
+import ctypes
+import ctypes.util
+import threading
+import numpy
+from optparse import OptionParser
+
+import logging
+# get logger
+log = logging.getLogger("fuzzy_pairing")
+
+# clock_gettime(CLOCK_MONOTONIC), python 2 has no monotonic clock
+CLOCK_MONOTONIC = 1
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _get_monotonic():
+    """monotonic clock function, time.time if there is none"""
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        log.warning('No monotonic clock, tracing with time.time')
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+        t = _timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+            return time.time()
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = _get_monotonic()
+
+# tracer of this process, see enable_tracing
+_tracer = None
+
+class Span(object):
+    """one traced step or stage, ends with ``end`` or at the end
+    of a with statement
+
+    :param tracer: ``Tracer`` that records the span
+    :param name: Name of step or stage like "agreement"
+    :param session: Pairing id
+    :param attributes: More values for the JSON line
+    """
+    def __init__(self, tracer, name, session, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.session = session
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.start = monotonic()
+        self.ended = False
+
+    def end(self, **attributes):
+        """record the span, ``attributes`` are added to it"""
+        if self.ended:
+            return
+        self.ended = True
+        duration = monotonic() - self.start
+        self.attributes.update(attributes)
+        self.tracer.record(self, duration)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.end()
+        return False
+
+class _NoSpan(object):
+    """span of disabled tracing, does nothing"""
+    def end(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NO_SPAN = _NoSpan()
+
+class Tracer(object):
+    """records spans as JSON lines in ``filename``, or in
+    ``spans`` if there is no file
+
+    :param source: Name of this device in the spans like "client"
+    :param filename: File the JSON lines are appended to, None for memory only
+    """
+    def __init__(self, source, filename=None):
+        self.source = source
+        self.filename = filename
+        self.spans = []
+        self.lock = threading.Lock()
+        self.file = None
+        if filename is not None:
+            self.file = open(filename, 'a')
+
+    def span(self, name, session=None, **attributes):
+        return Span(self, name, session, attributes)
+
+    def record(self, span, duration):
+        line = {'source': self.source, 'pid': os.getpid(), 'name': span.name,
+                'session': span.session, 'start': span.start_time,
+                'duration': duration}
+        line.update(span.attributes)
+        with self.lock:
+            if self.file is not None:
+                self.file.write(json.dumps(line)+'\n')
+                self.file.flush()
+            else:
+                self.spans.append(line)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def enable_tracing(source, filename=None):
+    """record spans of this process
+
+    :param source: Name of this device like "client" or "server"
+    :param filename: File for the JSON lines, None for memory only
+    :return: tracer -- The ``Tracer``
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(source, filename)
+    return _tracer
+
+def disable_tracing():
+    """record no spans anymore"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+
+def span(name, session=None, **attributes):
+    """start a span, use it in a with statement or call ``end``
+
+    Without ``enable_tracing`` a span that does nothing is returned.
+
+    :param name: Name of step or stage like "agreement"
+    :param session: Pairing id
+    :return: span -- ``Span``
+    """
+    if _tracer is None:
+        return NO_SPAN
+    return _tracer.span(name, session, **attributes)
+
+def trace_deferred(deferred, name, session=None, **attributes):
+    """span from now until ``deferred`` fires, for remote calls
+
+    :return: deferred -- The same Deferred
+    """
+    s = span(name, session, **attributes)
+    def end(result):
+        s.end()
+        return result
+    deferred.addBoth(end)
+    return deferred
+
+def trace_iter(iterable, name, session=None):
+    """span for the generation of every item of ``iterable``,
+    for example of candidate fingerprints"""
+    iterator = iter(iterable)
+    while True:
+        s = span(name, session)
+        try:
+            item = iterator.next()
+        except StopIteration:
+            return
+        s.end()
+        yield item
+
+def load_spans(filenames):
+    """read spans from JSON lines files"""
+    spans = []
+    for filename in filenames:
+        f = open(filename)
+        try:
+            for line in f:
+                if line.strip():
+                    spans.append(json.loads(line))
+        finally:
+            f.close()
+    return spans
+
+def summarize(spans, bins=10):
+    """durations per source and name
+
+    :param spans: List of spans like from ``load_spans``
+    :param bins: Number of bins of the histograms
+    :return: summary -- dict (source, name) -> dict with count, mean,
+             percentiles, total and histogram (counts, edges) in seconds
+    """
+    durations = {}
+    for s in spans:
+        durations.setdefault((s['source'], s['name']), []).append(s['duration'])
+
+    summary = {}
+    for key, values in durations.items():
+        values = numpy.array(values)
+        counts, edges = numpy.histogram(values, bins=bins)
+        summary[key] = {'count': len(values), 'mean': values.mean(),
+                        'p50': numpy.percentile(values, 50),
+                        'p95': numpy.percentile(values, 95),
+                        'max': values.max(), 'total': values.sum(),
+                        'histogram': (counts.tolist(), edges.tolist())}
+    return summary
+
+def main():
+    parser = OptionParser(usage='%prog [options] trace.jsonl ...')
+    parser.add_option('-b', '--bins', type='int', default=10,
+                      help='bins of the histograms')
+    parser.add_option('--histograms', action='store_true', default=False,
+                      help='print a histogram of every stage')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error('no trace file')
+
+    summary = summarize(load_spans(args), options.bins)
+    print '%-8s %-24s %7s %10s %10s %10s %10s' % ('source', 'name', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'max ms')
+    for (source, name), s in sorted(summary.items()):
+        print '%-8s %-24s %7d %10.1f %10.1f %10.1f %10.1f' % (source, name, s['count'], 1000*s['mean'], 1000*s['p50'], 1000*s['p95'], 1000*s['max'])
+        if options.histograms:
+            counts, edges = s['histogram']
+            for count, low, high in zip(counts, edges[:-1], edges[1:]):
+                print '    %10.1f - %10.1f ms %6d %s' % (1000*low, 1000*high, count, '#'*int(round(50.0*count/max(counts))))
+
+
+if __name__ == '__main__':
+    """summary of trace files
+    """
+    main()
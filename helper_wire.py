@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary encoding of commitments for the remote calls
+
+    :platform: Linux
+    :synopsis: Wire Format
+
+Sent as Python lists, the 512 delta symbols and the hex string of the
+hash are serialized element by element by Twisted's jelly. The wire
+format packs them into one string instead:
+
+======  ==========================================================
+bytes   content
+======  ==========================================================
+1       version, ``WIRE_VERSION``
+1       symbol size in bits
+2       number of symbols, big endian
+1       length of the hash in bytes
+...     raw hash
+...     symbols, every symbol with symbol size bits, most
+        significant bit first, padded with zeros to full bytes
+======  ==========================================================
+
+Fingerprints (only sent in debug mode) are the same with symbol size 1
+and no hash.
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+import struct
+import binascii
+import numpy
+
+WIRE_VERSION = 1
+
+# version, symbol size, number of symbols, hash length
+HEADER = struct.Struct('>BBHB')
+
+def pack_symbols(symbols, symsize):
+    """pack every symbol into ``symsize`` bits
+
+    :param symbols: Integers between 0 and :math:`2^{symsize}-1`
+    :param symsize: Bits per symbol
+    :return: packed -- str
+    """
+    symbols = numpy.asarray(symbols, dtype=numpy.uint16)
+    shifts = numpy.arange(symsize-1, -1, -1, dtype=numpy.uint16)
+    bits = ((symbols[:,numpy.newaxis] >> shifts) & 1).astype(numpy.uint8)
+    return numpy.packbits(bits.ravel()).tostring()
+
+def unpack_symbols(data, count, symsize, offset=0):
+    """inverse of ``pack_symbols``, reads ``data`` without copying it
+
+    :return: symbols -- numpy array of ``count`` integers
+    :raise: ValueError if data is too short
+    """
+    length = (count*symsize + 7) / 8
+    if len(data) - offset < length:
+        raise ValueError("Wire data has "+str(len(data)-offset)+" bytes of symbols, not "+str(length))
+    packed = numpy.frombuffer(data, dtype=numpy.uint8, count=length, offset=offset)
+    bits = numpy.unpackbits(packed)[0:count*symsize].reshape(count, symsize)
+    weights = 1 << numpy.arange(symsize-1, -1, -1, dtype=numpy.int64)
+    return bits.dot(weights)
+
+def encode(symbols, symsize, hash=''):
+    """header, raw ``hash`` and packed ``symbols``
+
+    :return: data -- str
+    """
+    return HEADER.pack(WIRE_VERSION, symsize, len(symbols), len(hash)) + hash + pack_symbols(symbols, symsize)
+
+def decode(data):
+    """inverse of ``encode``
+
+    :return: symbols -- numpy array
+    :return: symsize -- Bits per symbol
+    :return: hash -- Raw hash
+    :raise: ValueError if data is no wire data of this version
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Wire data too short")
+    version, symsize, count, hash_length = HEADER.unpack_from(data)
+    if version != WIRE_VERSION:
+        raise ValueError("Unknown wire version "+str(version))
+    hash = data[HEADER.size:HEADER.size+hash_length]
+    if len(hash) != hash_length:
+        raise ValueError("Wire data too short for the hash")
+    symbols = unpack_symbols(data, count, symsize, HEADER.size+hash_length)
+    return symbols, symsize, hash
+
+def encode_commitment(hash, delta, symsize):
+    """encode hash and delta of ``crypto_fuzzy_jw.JW_commit``
+
+    :param hash: Hash as returned by ``JW_commit``, a list with the hex digest
+    :param delta: Difference between fingerprint and codeword
+    :param symsize: Parameter for Reed-Solomon-Code.
+    :return: data -- str
+    """
+    return encode(delta, symsize, binascii.unhexlify(hash[0]))
+
+def decode_commitment(data):
+    """inverse of ``encode_commitment``
+
+    :return: hash -- like returned by ``JW_commit``
+    :return: delta -- numpy array
+    :raise: ValueError if data is no commitment
+    """
+    delta, symsize, hash = decode(data)
+    return [binascii.hexlify(hash)], delta
+
+def encode_fingerprint(fingerprint):
+    """fingerprint with one bit per bit, debug only"""
+    return encode(fingerprint, 1)
+
+def decode_fingerprint(data):
+    """inverse of ``encode_fingerprint``"""
+    fingerprint, symsize, hash = decode(data)
+    if symsize != 1:
+        raise ValueError("Wire data is no fingerprint")
+    return fingerprint
@@ -13,20 +13,21 @@ import logging
 import scipy
 
 import thread, os
+import uuid
 
 import crypto_fuzzy_jw
-import fingerprint_energy_diff
-
-from Crypto.Cipher import AES
 
 from twisted.spread import pb
-from twisted.internet import reactor
+from twisted.internet import reactor, threads, defer
 
-from helper_audio_recording import record_at_time
+from helper_audio_recording import record_at_time, get_recording_duration, rms_gate
 from helper_audio import load_stereo, load_mono
+from helper_audio_capture import CaptureService, MicrophoneSource
 
 from helper_check_ntp import time_in_sync
-from helper_implementation import generate_key_for_aes
+from helper_wire import encode_commitment, encode_fingerprint
+from helper_tracing import span, trace_deferred, enable_tracing, NO_SPAN
+from implementation_engine import PairingEngine
 
 # Logging all above INFO level, output to stderr
 logging.basicConfig(#format='%(asctime)s %(levelname)-8s %(message)s')
@@ -42,6 +43,10 @@ def main():
 
     # instatiate agreement object of client
     pairing = PairingClient(device_id="Alice")
+    # record all the time, so pairing needs no lead time and no recording time
+    #pairing.capture_service = CaptureService(MicrophoneSource()).start()
+    # write timing of every step, see helper_tracing
+    #enable_tracing("client", "client_trace.jsonl")
     # get root object (Agreement) and start request_connection
     factory.getRootObject().addCallback(pairing.request_connection)
     
@@ -52,22 +57,32 @@ class PairingClient:
     def __init__(self, device_id):
         """Initialize PairingClient object
     
+        Fingerprint and code settings are in ``engine``.
+        
         :param device_id: Identification string, should be "Alice"
         :type decide_id: str
         """
         self.pairing_server = None
+        self.pairing_session = None
         self.fingerprint = None
         self.delta = None
         self.hash = None
         self.private_key = None
         self.device_id = device_id
+        self.pairing_id = None # correlates the traces of client and server
+        self.pairing_span = NO_SPAN
         self.recording_data = None
         self.recording_samplerate = None
         self.recording_use_file = False
         self.recording_file = 'client_recording.wav'
-        self.rs_code_m = 152
-        self.rs_code_n = 512
-        self.rs_code_symsize = 10
+        self.recording_duration = get_recording_duration() # seconds, fingerprint plus alignment margin
+        self.recording_quality_gate = None # like rms_gate(100), records longer if the gate rejects
+        self.recording_max_duration = 9 # seconds, limit for the quality gate
+        self.capture_service = None # always running CaptureService, optional
+        self.engine = PairingEngine() # fingerprinting and fuzzy cryptography
+        self.use_commitment_pool = True # generate the random codeword while recording
+        self.use_wire_format = True # send commitment packed, see helper_wire
+        self.commitment_pool = None
         self.check_ntp = False
         self.debug = False # Using this means NO security!
     
@@ -81,9 +96,13 @@ class PairingClient:
         # set agreement reference to server on self object
         self.pairing_server = pairing_server
         
+        self.pairing_id = uuid.uuid4().hex
+        self.pairing_span = span('pairing', self.pairing_id)
+        
         # remote call for requesting connection
         # very very simple implementation with device_id
-        accept_connection = self.pairing_server.callRemote("connection", self.device_id)
+        accept_connection = self.pairing_server.callRemote("connection", self.device_id, self.pairing_id)
+        trace_deferred(accept_connection, 'connection', self.pairing_id)
         
         # get answer
         accept_connection.addCallbacks(self.answer_connection)
@@ -94,13 +113,15 @@ class PairingClient:
         Alice checks if connection was acepted, then checks NTP time
         and starts synchronized recording
         
-        :param accept_connection: callback from Bob
-        :type accept_connection: bool
+        :param accept_connection: callback from Bob, his ``PairingSession`` or False
+        :type accept_connection: RemoteReference
         """
         log.info('3. Alice gets answer from Bob')
         
         if accept_connection:
             log.info('Bob accepted connection')
+            # the rest of the pairing uses Bobs session for Alice
+            self.pairing_session = accept_connection
             if self.check_ntp:
                 # check NTP
                 if not time_in_sync():
@@ -110,24 +131,51 @@ class PairingClient:
                     log.info('NTP time ok')
             
             # here 4 and 5 are called synchron!
-            # record own data in thread
-            
-            # define start time
-            start_time = time.time()+3
-            
-            # for testing with sound
-            #thread.start_new_thread(os.system, ("sleep 2; aplay test_background.wav",))
-            
+            start_time = self.get_start_time()
             
             # call local on client
-            reactor.callInThread(self.do_recording, start_time)
+            own_recording = self.start_recording(start_time)
             # call remote on server
-            successfull_server_recording = self.pairing_server.callRemote("recording", start_time)
-            successfull_server_recording.addCallbacks(self.answer_recording)
+            successfull_server_recording = self.pairing_session.callRemote("recording", start_time)
+            trace_deferred(successfull_server_recording, 'server_recording', self.pairing_id)
+            
+            # continue when both recordings have ended
+            recordings = defer.gatherResults([own_recording, successfull_server_recording], consumeErrors=True)
+            recordings.addCallback(lambda results: results[1])
+            recordings.addCallbacks(self.answer_recording, self.pairing_error)
         else:
             log.info('Bob denied connection')
             self.stop_pairing()
         
+    def get_start_time(self):
+        """time when both devices start recording
+        
+        :return: start_time -- Absolute time
+        """
+        if self.capture_service is not None:
+            # the last seconds are already recorded on both devices
+            return time.time()-self.recording_duration
+        else:
+            return time.time()+3
+        
+    def start_recording(self, start_time):
+        """record own data in thread, see ``do_recording``
+        
+        :param start_time: Absolute time when recording should start
+        :type start_time: int
+        :return: Deferred that fires when the recording has ended
+        """
+        # for testing with sound
+        #thread.start_new_thread(os.system, ("sleep 2; aplay test_background.wav",))
+        
+        # random codeword for the commitment is ready after recording
+        if self.use_commitment_pool and self.commitment_pool is None:
+            self.commitment_pool = crypto_fuzzy_jw.CommitmentPool(m=self.engine.rs_code_m, n=self.engine.rs_code_n, symsize=self.engine.rs_code_symsize).start()
+        
+        own_recording = threads.deferToThread(self.do_recording, start_time)
+        trace_deferred(own_recording, 'recording', self.pairing_id)
+        return own_recording
+        
     def do_recording(self, start_time):
         """4. Alice requests recording
         (4 and 5 are called synchronous at ``start_time``)
@@ -144,13 +192,17 @@ class PairingClient:
             #left_channel, right_channel, self.recording_samplerate = load_stereo(self.recording_file)
             #self.recording_data = left_channel
             self.recording_data, self.recording_samplerate = load_mono(self.recording_file)
+        elif self.capture_service is not None:
+            # cut recording out of the always running capture
+            self.recording_data, self.recording_samplerate = self.capture_service.get_window(start_time, self.recording_duration)
         else:
             # start recording at start_time
-            self.recording_data, self.recording_samplerate = record_at_time("client.wav", 7, start_time)
+            self.recording_data, self.recording_samplerate = record_at_time("client.wav", self.recording_duration, start_time, quality_gate=self.recording_quality_gate, max_duration=self.recording_max_duration)
         
     def answer_recording(self, successfull_server_recording):
         """6. Alice gets answer of recording
         
+        Called when the own recording has ended, too.
         If Alice gets successfull answer from Bob, Alice starts
         the agreement
         
@@ -159,9 +211,6 @@ class PairingClient:
         """
         log.info('6. Alice gets answer of recording')
         
-        # wait a little bit to ensure that the own recording has ended
-        time.sleep(1)
-        
         if successfull_server_recording:
             log.info('Bob recorded successfully')
             
@@ -174,39 +223,63 @@ class PairingClient:
     
     def request_agreement(self):
         """7. Alice starts key agreement
-        generate fingerprint and doing fuzzy commitment
-        send hash and delta to Bob
+        generate fingerprint and doing fuzzy commitment in a thread,
+        then send hash and delta to Bob
         """
         log.info('7. Alice starts key agreement')
+        
+        commitment = threads.deferToThread(self.commit)
+        commitment.addCallbacks(self.send_commitment, self.pairing_error)
+        
+    def commit(self):
+        """generate fingerprint and doing fuzzy commitment
+        
+        Runs in a thread, fingerprinting takes too long for the reactor.
+        """
 
         #===============================================================================
         # Fingerprinting and Fuzzy Cryptography
         #===============================================================================
         # generate fingerprint
-        self.fingerprint = fingerprint_energy_diff.get_fingerprint(self.recording_data, self.recording_samplerate)
+        fingerprint_span = span('fingerprint', self.pairing_id)
+        self.fingerprint = self.engine.fingerprint(self.recording_data, self.recording_samplerate)
+        fingerprint_span.end()
         
         # save fingerprint for debugging
         scipy.savetxt("client_fingerprint.txt", self.fingerprint)
 
         log.debug('Alice fingerprint:\n'+str(self.fingerprint))
         
-        # doing commit, rs codes can correct up to (n-m)/2 errors
-        self.hash, self.delta, self.private_key = crypto_fuzzy_jw.JW_commit(self.fingerprint, m=self.rs_code_m, n=self.rs_code_n, symsize=self.rs_code_symsize)
+        # doing commit
+        commit_span = span('commit', self.pairing_id)
+        codeword = None
+        if self.commitment_pool is not None:
+            codeword = self.commitment_pool.get()
+        self.hash, self.delta, self.private_key = self.engine.commit(self.fingerprint, codeword)
+        commit_span.end(pooled=codeword is not None)
         
         log.debug('Alice Blob:\nHash:\n'+str(self.hash)+'\nDelta:\n'+str(self.delta))
         
         # save delta for debugging
         scipy.savetxt("client_delta.txt", self.delta)
         
+    def send_commitment(self, result):
+        """send hash and delta of ``commit`` to Bob"""
         # remote call for key agreement
         # using debug means sending also the fingerprint in clear text!!!
         # meaning no security!
-        if self.debug:
-            accept_agreement = self.pairing_server.callRemote("agreement_debug", self.fingerprint.tolist(), self.hash, self.delta.tolist())
-            accept_agreement.addCallbacks(self.answer_agreement)
+        if self.use_wire_format:
+            commitment = encode_commitment(self.hash, self.delta, self.engine.rs_code_symsize)
+            if self.debug:
+                accept_agreement = self.pairing_session.callRemote("agreement_debug", encode_fingerprint(self.fingerprint), commitment)
+            else:
+                accept_agreement = self.pairing_session.callRemote("agreement", commitment)
+        elif self.debug:
+            accept_agreement = self.pairing_session.callRemote("agreement_debug", self.fingerprint.tolist(), self.hash, self.delta.tolist())
         else:
-            accept_agreement = self.pairing_server.callRemote("agreement", self.hash, self.delta.tolist())
-            accept_agreement.addCallbacks(self.answer_agreement)
+            accept_agreement = self.pairing_session.callRemote("agreement", self.hash, self.delta.tolist())
+        trace_deferred(accept_agreement, 'agreement', self.pairing_id)
+        accept_agreement.addCallbacks(self.answer_agreement, self.pairing_error)
         
     def answer_agreement(self, accept_agreement):
         """9. Alice gets answer of agreement from Bob
@@ -223,7 +296,8 @@ class PairingClient:
             log.info('Bob accepted agreement')
             
             # get DataServer object
-            data_server = self.pairing_server.callRemote("get_data")
+            data_server = self.pairing_session.callRemote("get_data")
+            trace_deferred(data_server, 'get_data', self.pairing_id)
             data_server.addCallbacks(self.got_data)
         else:
             log.info('Bob denied agreement')
@@ -245,13 +319,35 @@ class PairingClient:
         data_client = DataClient(self, data_server)
 
         # send message
-        time.sleep(1)
-        data_client.send_encrypted_message("Hello, this is a message")
+        sent = data_client.send_encrypted_message("Hello, this is a message")
+        trace_deferred(sent, 'send_message', self.pairing_id)
+        sent.addCallbacks(self.pairing_done, self.pairing_error)
+        
+    def pairing_done(self, result):
+        """message was sent, pairing was successfull"""
+        self.pairing_span.end(success=True)
+        self.discard_codewords()
+        
+    def pairing_error(self, failure):
+        """errback of local threads and remote calls"""
+        log.error('Error in pairing: '+failure.getErrorMessage())
+        self.stop_pairing()
         
     def stop_pairing(self):
         log.error("Pairing failed")
+        self.pairing_span.end(success=False)
+        self.discard_codewords()
         reactor.stop()
         
+    def discard_codewords(self):
+        """stop the commitment pool and overwrite the codeword of the
+        commitment, it is the key and not needed after the message
+        """
+        if self.commitment_pool is not None:
+            self.commitment_pool.stop()
+        if self.private_key is not None:
+            self.private_key[:] = 0
+        
 class DataClient:
     def __init__(self, pairing_client, data_server):
         """Initialize DataClient object
@@ -274,15 +370,15 @@ class DataClient:
         """
         log.info('12. Alice sends message to Bob')
         
-        self.data_server.callRemote("send_message", message)
+        return self.data_server.callRemote("send_message", message)
         
     def send_encrypted_message(self, message):
         """12. Alice sends encrypted message to Bob
         
         Remote call to send ``message`` **encrypted** to Bob.
-        With ``generate_key_for_aes`` it generates an AES key
-        from the ``private_key`` attribute of the ``DataClient`` object.
-        This AES key is used to encrypt with AES.
+        ``PairingEngine.encrypt`` generates an AES key from the
+        ``private_key`` attribute of the ``PairingClient`` object with
+        ``generate_key_for_aes`` and encrypts with AES.
         
         :param message: Message to send
         :type message: str
@@ -291,22 +387,12 @@ class DataClient:
         
         private_key = self.pairing_client.private_key
         
-        # use key to generate key usefull fo AES
-        aes_key = generate_key_for_aes(private_key)
-        
-        # padding message to a length of a multiple of 16
-        while ((len(message) % 16) != 0):
-            message += 'X'
-        
         # do encryption with AES
-        aes_obj = AES.new(aes_key, AES.MODE_ECB)
-        ciphertext = aes_obj.encrypt(message)
+        ciphertext = self.pairing_client.engine.encrypt(private_key, message)
         
         log.info('Alice ciphertext:\n'+repr(ciphertext))
         
-        # little fix to delay the remote call
-        time.sleep(1)
-        self.data_server.callRemote("send_encrypted_message", ciphertext)
+        return self.data_server.callRemote("send_encrypted_message", ciphertext)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Fuzzy Pairing Engine, the protocol without transport
+
+    :platform: Linux
+    :synopsis: Pairing Engine
+
+``PairingEngine`` has the computations of client and server:
+fingerprinting, commitment, candidate search, decommitment and the AES
+key. ``PairingClient`` and ``PairingServer`` only record, send the
+results and call the engine. ``PairingEngine.pair`` runs a whole pairing
+on two recordings in this process, for simulations without network::
+
+    engine = PairingEngine()
+    result = engine.pair(client_data, 44100, server_data, 44100)
+
+The methods keep no state between calls, one engine can be used from
+several threads at the same time, like with ``threads.deferToThread``,
+and it can be pickled to worker processes.
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+from __future__ import with_statement
+import logging
+
+import crypto_fuzzy_jw
+import fingerprint_energy_diff
+
+from Crypto.Cipher import AES
+
+from helper_implementation import generate_key_for_aes, get_candidate_fingerprints
+from helper_tracing import span
+
+# get logger
+log = logging.getLogger("fuzzy_pairing")
+
+class PairingEngine(object):
+    def __init__(self):
+        """Initialize PairingEngine object
+
+        The attributes are the settings of the pairing, fingerprint
+        and code settings must be the same on both devices.
+        """
+        self.fingerprint_rate = None # like 5512.5 Hz for decimated fingerprints, same on both devices
+        self.rs_code_m = 152
+        self.rs_code_n = 512
+        self.rs_code_symsize = 10
+        self.use_erasures = True # mark unreliable fingerprint bits as erasures
+        self.use_list_decoding = False # correct beyond (n-m)/2 if unique decoding fails, about 0.3 s per decode!
+        self.list_decoding_candidates = 0 # candidates decoded with list decoding, the others only unique
+        self.candidate_budget = 351 # time shifts and flipped bits together
+        self.chase_share = 0.2 # share of candidates with flipped bits
+        self.chase_positions = 7 # number of unreliable bits to flip
+
+    def fingerprint(self, data, samplerate, reliability=False):
+        """fingerprint of a recording, see ``fingerprint_energy_diff.get_fingerprint``
+
+        :param data: Mono recording
+        :param samplerate: Samplerate of ``data``
+        :param reliability: Return the reliability of every bit, too
+        :return: fingerprint -- numpy array of bits
+        :return: reliability -- only with ``reliability``
+        """
+        return fingerprint_energy_diff.get_fingerprint(data, samplerate, reliability=reliability, fingerprint_rate=self.fingerprint_rate)
+
+    def commit(self, fingerprint, codeword=None):
+        """7. fuzzy commitment of Alice, rs codes can correct up to (n-m)/2 errors
+
+        :param fingerprint: Fingerprint of Alice
+        :param codeword: Random codeword like from ``CommitmentPool.get``, generated if None
+        :return: hash -- Hash of the codeword
+        :return: delta -- Difference between fingerprint and codeword
+        :return: private_key -- The codeword
+        """
+        return crypto_fuzzy_jw.JW_commit(fingerprint, m=self.rs_code_m, n=self.rs_code_n, symsize=self.rs_code_symsize, codeword=codeword)
+
+    def candidates(self, data, samplerate, fingerprint, reliability):
+        """candidate fingerprints of Bob, see ``get_candidate_fingerprints``
+
+        Generated lazily, nothing is calculated until the first candidate
+        is needed. Without the unshifted ``fingerprint``, if ``decommit``
+        already decodes it with erasures.
+
+        :return: candidates -- generator of (strategy, parameter, fingerprint)
+        """
+        return get_candidate_fingerprints(data, samplerate, fingerprint=fingerprint, reliability=reliability,
+                                          budget=self.candidate_budget, chase_share=self.chase_share,
+                                          chase_positions=self.chase_positions,
+                                          fingerprint_rate=self.fingerprint_rate,
+                                          unshifted=not self.erasures_tried(reliability))
+
+    def erasures_tried(self, reliability):
+        """True if ``decommit`` decodes the own fingerprint with erasures
+        before the candidates, starting with no erasures
+        """
+        return self.use_erasures and reliability is not None
+
+    def decommit(self, hash, delta, fingerprint, reliability=None, candidates=(), cancelled=None, session=None):
+        """8. decommitment of Bob
+
+        First with the unreliable bits of ``fingerprint`` as erasures,
+        then with every candidate fingerprint until one decommits.
+
+        With ``use_list_decoding`` a failed unique decoding costs about
+        0.3 s more, so list decoding is used for the own fingerprint and
+        only for the first ``list_decoding_candidates`` candidates, not
+        for all ``candidate_budget`` of them.
+
+        :param hash: SHA-512 Hash of codeword c
+        :param delta: difference
+        :param fingerprint: Fingerprint of Bob
+        :param reliability: reliability of every bit in ``fingerprint``, no erasures if None
+        :param candidates: Candidates like from ``candidates``
+        :param cancelled: ``threading.Event``, stops trying candidates when set
+        :param session: Pairing id for the traces
+        :return: private_key -- The codeword of Alice, None if every decommit failed
+        :return: strategy -- (strategy, parameter) of the successful fingerprint
+        :return: tried -- Number of candidates tried
+        """
+        if self.erasures_tried(reliability):
+            try:
+                # trying to decommit with unreliable bits as erasures
+                with span('decode', session, strategy='erasures'):
+                    private_key, corr = crypto_fuzzy_jw.JW_decommit(hash, delta, fingerprint, m=self.rs_code_m, n=self.rs_code_n, symsize=self.rs_code_symsize, reliability=reliability, list_decoding=self.use_list_decoding)
+            except Exception, err:
+                log.error('%s' % str(err))
+            else:
+                return private_key, ('erasures', None), 0
+
+        tried = 0
+        for strategy, parameter, candidate in candidates:
+            if cancelled is not None and cancelled.isSet():
+                log.info('Decommit cancelled after '+str(tried)+' candidates')
+                break
+            tried += 1
+            list_decoding = self.use_list_decoding and tried <= self.list_decoding_candidates
+            try:
+                # trying to decommit
+                with span('decode', session, strategy=strategy):
+                    private_key, corr = crypto_fuzzy_jw.JW_decommit(hash, delta, candidate, m=self.rs_code_m, n=self.rs_code_n, symsize=self.rs_code_symsize, list_decoding=list_decoding)
+            except Exception, err:
+                log.error('%s' % str(err))
+            else:
+                # if hash is the same accept key agreement,
+                # test is in JW_decommit, try fails when not!
+                log.info('Decommit successfull with candidate '+str(tried)+' of strategy '+strategy+': '+str(parameter))
+                return private_key, (strategy, parameter), tried
+
+        # if every fingerprint fails to decommit pairing fails
+        return None, None, tried
+
+    def encrypt(self, private_key, message):
+        """12. AES encryption of ``message`` with the key from ``private_key``
+
+        :param private_key: Codeword of the pairing
+        :param message: Message, padded with 'X' to a multiple of 16
+        :return: ciphertext -- str
+        """
+        # use key to generate key usefull fo AES
+        aes_key = generate_key_for_aes(private_key)
+
+        # padding message to a length of a multiple of 16
+        while ((len(message) % 16) != 0):
+            message += 'X'
+
+        # do encryption with AES
+        aes_obj = AES.new(aes_key, AES.MODE_ECB)
+        return aes_obj.encrypt(message)
+
+    def decrypt(self, private_key, ciphertext):
+        """13. AES decryption of ``ciphertext`` with the key from ``private_key``
+
+        :return: message -- str, with padding
+        """
+        # use key to generate key usefull fo aes
+        aes_key = generate_key_for_aes(private_key)
+
+        # doing decryption
+        aes_obj = AES.new(aes_key, AES.MODE_ECB)
+        return aes_obj.decrypt(ciphertext)
+
+    def pair(self, client_data, client_samplerate, server_data, server_samplerate):
+        """whole pairing of Alice and Bob on their recordings
+
+        :param client_data: Recording of Alice
+        :param client_samplerate: Samplerate of ``client_data``
+        :param server_data: Recording of Bob
+        :param server_samplerate: Samplerate of ``server_data``
+        :return: result -- dict with success, strategy (see ``decommit``),
+                 tried (candidates) and key (AES key of both, None if failed)
+        """
+        # Alice
+        fingerprint = self.fingerprint(client_data, client_samplerate)
+        hash, delta, client_key = self.commit(fingerprint)
+
+        # Bob
+        fingerprint, reliability = self.fingerprint(server_data, server_samplerate, reliability=True)
+        candidates = self.candidates(server_data, server_samplerate, fingerprint, reliability)
+        server_key, strategy, tried = self.decommit(hash, delta, fingerprint, reliability, candidates)
+
+        key = None
+        if server_key is not None:
+            key = generate_key_for_aes(client_key)
+            if generate_key_for_aes(server_key) != key:
+                key = None
+        return {'success': key is not None, 'strategy': strategy, 'tried': tried, 'key': key}
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Fuzzy Pairing over a framed stream protocol
+
+    :platform: Linux
+    :synopsis: Framed Implementation
+
+Client and server of ``implementation_client`` and
+``implementation_server`` without Perspective Broker. Every message is
+one frame of ``Int32StringReceiver`` (4 bytes length, big endian) with
+the message type in the first byte:
+
+============  ==============================================  ============
+type          payload of the request                          reply
+============  ==============================================  ============
+CONNECTION    device id, zero byte, pairing id                accepted
+RECORDING     start time, ``RECORDING_TIME`` struct           recorded
+AGREEMENT     commitment, ``helper_wire.encode_commitment``   decommitted
+DATA          AES ciphertext of the message                   decrypted
+============  ==============================================  ============
+
+Replies are the ``REPLY`` struct with the type of the request and 1 or
+0, in the order of the requests. A connection has one session, the
+session is closed with the connection.
+
+The server answers the requests one after another, so the client sends
+requests without waiting for the reply if it knows them already:
+connection and recording together, commitment and encrypted message
+together. After connecting, a pairing needs 2 round trips (connection
+and recording, agreement and message) instead of 6 with Perspective
+Broker (root object, connection, recording, agreement, get_data and
+message).
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+import sys
+import struct
+import uuid
+import logging
+
+from twisted.internet import reactor, defer, protocol
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.protocols.basic import Int32StringReceiver
+
+from helper_check_ntp import time_in_sync
+from helper_wire import encode_commitment
+from helper_tracing import span, trace_deferred
+from implementation_client import PairingClient
+from implementation_server import PairingServer, DataServer
+
+# get logger
+log = logging.getLogger("fuzzy_pairing")
+
+# message types
+CONNECTION = 1
+RECORDING = 2
+AGREEMENT = 3
+DATA = 4
+
+MESSAGE_TYPE = struct.Struct('>B')
+# start time of the recording
+RECORDING_TIME = struct.Struct('>d')
+# type of the request, 1 if successfull
+REPLY = struct.Struct('>BB')
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'client':
+        # start client and connect to port 4201
+        host = sys.argv[2] if len(sys.argv) > 2 else "localhost"
+        pairing = FramedPairingClient(device_id="Alice")
+        connected = connectProtocol(TCP4ClientEndpoint(reactor, host, 4201), FramedClientProtocol())
+        connected.addCallbacks(pairing.request_connection, pairing.pairing_error)
+    else:
+        # start server
+        reactor.listenTCP(4201, FramedServerFactory(PairingServer()))
+    reactor.run()
+
+class FramedServerProtocol(Int32StringReceiver):
+    """one connection of a client to the ``PairingServer`` of the factory"""
+    MAX_LENGTH = 65536
+
+    # method for every message type
+    handlers = {CONNECTION: 'connection',
+                RECORDING: 'recording',
+                AGREEMENT: 'agreement',
+                DATA: 'data'}
+
+    def connectionMade(self):
+        self.session = None
+        # requests are answered in order
+        self.queue = defer.succeed(None)
+
+    def connectionLost(self, reason):
+        if self.session is not None:
+            self.session.close()
+
+    def stringReceived(self, frame):
+        if not frame or ord(frame[0]) not in self.handlers:
+            log.error('Unknown message, closing connection')
+            self.transport.loseConnection()
+            return
+        self.queue.addCallback(self.handle, ord(frame[0]), frame[1:])
+
+    def handle(self, result, message_type, payload):
+        """call the handler of ``message_type`` after the former requests"""
+        answer = defer.maybeDeferred(getattr(self, self.handlers[message_type]), payload)
+        answer.addErrback(self.handle_error)
+        answer.addCallback(self.reply, message_type)
+        return answer
+
+    def handle_error(self, failure):
+        log.error('Error in request: '+failure.getErrorMessage())
+        return False
+
+    def reply(self, result, message_type):
+        self.sendString(REPLY.pack(message_type, bool(result)))
+
+    def get_session(self):
+        """session of this connection, None if denied or closed"""
+        if self.session is None or self.session.closed:
+            return None
+        self.session.touch()
+        return self.session
+
+    def connection(self, payload):
+        """2. Bob accepts or denies connection request,
+        see ``PairingServer.remote_connection``, only one per connection"""
+        if self.session is not None:
+            log.error('Connection has a session already')
+            return False
+        device_id, pairing_id = payload.split('\0', 1)
+        session = self.factory.pairing_server.remote_connection(device_id, pairing_id or None)
+        if session:
+            self.session = session
+        return bool(session)
+
+    def recording(self, payload):
+        """5. remote recording, see ``PairingSession.remote_recording``"""
+        session = self.get_session()
+        if session is None:
+            return False
+        start_time, = RECORDING_TIME.unpack(payload)
+        return session.remote_recording(start_time)
+
+    def agreement(self, payload):
+        """8. Key Agreement on Server, see ``PairingSession.remote_agreement``"""
+        session = self.get_session()
+        if session is None:
+            return False
+        return session.remote_agreement(payload)
+
+    def data(self, payload):
+        """13. encrypted message, decrypted only after a successfull agreement"""
+        session = self.get_session()
+        if session is None or session.private_key is None:
+            return False
+        DataServer(session).remote_send_encrypted_message(payload)
+        return True
+
+class FramedServerFactory(protocol.ServerFactory):
+    protocol = FramedServerProtocol
+
+    def __init__(self, pairing_server):
+        """Initialize FramedServerFactory object
+
+        :param pairing_server: ``PairingServer`` with settings and sessions
+        :type pairing_server: PairingServer
+        """
+        self.pairing_server = pairing_server
+
+class FramedClientProtocol(Int32StringReceiver):
+    """connection of the client, ``request`` sends without waiting
+    for the replies of former requests"""
+    MAX_LENGTH = 65536
+
+    def connectionMade(self):
+        self.pending = []
+
+    def request(self, message_type, payload=''):
+        """send a request
+
+        :param message_type: Like ``RECORDING``
+        :param payload: Payload of the request
+        :return: Deferred with True if the request was successfull
+        """
+        answer = defer.Deferred()
+        self.pending.append((message_type, answer))
+        self.sendString(MESSAGE_TYPE.pack(message_type) + payload)
+        return answer
+
+    def stringReceived(self, frame):
+        if not self.pending:
+            log.error('Reply without request')
+            return
+        expected, answer = self.pending.pop(0)
+        try:
+            message_type, status = REPLY.unpack(frame)
+        except struct.error, err:
+            answer.errback(ValueError('Reply is no reply: '+str(err)))
+            return
+        if message_type != expected:
+            answer.errback(ValueError('Reply of type '+str(message_type)+', not '+str(expected)))
+        else:
+            answer.callback(bool(status))
+
+    def connectionLost(self, reason):
+        pending, self.pending = self.pending, []
+        for message_type, answer in pending:
+            answer.errback(reason)
+
+class FramedPairingClient(PairingClient):
+    def __init__(self, device_id):
+        """Initialize FramedPairingClient object
+
+        ``PairingClient`` that sends the commitment in the wire format
+        and the message right behind it, there is no debug mode.
+
+        :param device_id: Identification string, should be "Alice"
+        :type decide_id: str
+        """
+        PairingClient.__init__(self, device_id)
+        self.protocol = None
+        self.message = "Hello, this is a message"
+
+    def request_connection(self, protocol):
+        """1. Alice requests connection and recording
+
+        :param protocol: Connected ``FramedClientProtocol``
+        """
+        log.info('1. Alice requests connection')
+        self.protocol = protocol
+
+        self.pairing_id = uuid.uuid4().hex
+        self.pairing_span = span('pairing', self.pairing_id)
+
+        if self.check_ntp:
+            # check NTP
+            if not time_in_sync():
+                log.info('Local time not in sync with NTP')
+                self.stop_pairing()
+                return
+            log.info('NTP time ok')
+
+        # here 4 and 5 are called synchron!
+        start_time = self.get_start_time()
+
+        # Bob records only if he accepted the connection
+        accept_connection = protocol.request(CONNECTION, self.device_id+'\0'+self.pairing_id)
+        trace_deferred(accept_connection, 'connection', self.pairing_id)
+        successfull_server_recording = protocol.request(RECORDING, RECORDING_TIME.pack(start_time))
+        trace_deferred(successfull_server_recording, 'server_recording', self.pairing_id)
+
+        own_recording = self.start_recording(start_time)
+
+        # continue when both recordings have ended
+        recordings = defer.gatherResults([accept_connection, own_recording, successfull_server_recording], consumeErrors=True)
+        recordings.addCallbacks(self.answer_recordings, self.pairing_error)
+
+    def answer_recordings(self, results):
+        """3. and 6. Alice gets answers of connection and recording
+
+        :param results: Replies of connection, own recording and recording
+        """
+        accept_connection, own_recording, successfull_server_recording = results
+        if not accept_connection:
+            log.info('Bob denied connection')
+            self.stop_pairing()
+            return
+        self.answer_recording(successfull_server_recording)
+
+    def send_commitment(self, result):
+        """send commitment of ``commit`` and the encrypted message to Bob"""
+        commitment = encode_commitment(self.hash, self.delta, self.engine.rs_code_symsize)
+        accept_agreement = self.protocol.request(AGREEMENT, commitment)
+        trace_deferred(accept_agreement, 'agreement', self.pairing_id)
+
+        # encrypted with the own key, Bob decrypts only if he decommits
+        log.info('12. Alice sends encrypted message to Bob')
+        ciphertext = self.engine.encrypt(self.private_key, self.message)
+        sent = self.protocol.request(DATA, ciphertext)
+        trace_deferred(sent, 'send_message', self.pairing_id)
+
+        answers = defer.gatherResults([accept_agreement, sent], consumeErrors=True)
+        answers.addCallbacks(self.answer_agreement, self.pairing_error)
+
+    def answer_agreement(self, results):
+        """9. Alice gets answers of agreement and message from Bob
+
+        :param results: Replies of agreement and message
+        """
+        log.info('9. Alice gets answer of agreement from Bob')
+        accept_agreement, received = results
+
+        if accept_agreement and received:
+            log.info('Bob accepted agreement and message')
+            self.protocol.transport.loseConnection()
+            self.pairing_done(True)
+        else:
+            log.info('Bob denied agreement')
+            self.stop_pairing()
+
+    def stop_pairing(self):
+        if self.protocol is not None:
+            self.protocol.transport.loseConnection()
+        PairingClient.stop_pairing(self)
+
+
+if __name__ == '__main__':
+    """start server, or client with "client [host]"
+    """
+    main()
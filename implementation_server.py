@@ -8,24 +8,27 @@ Fuzzy Pairing Server Implementation
 .. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
 
 """
+from __future__ import with_statement
 import logging
 import scipy
-
-import crypto_fuzzy_jw
-import fingerprint_energy_diff
-
-from Crypto.Cipher import AES
+import threading
+from itertools import count
 
 from twisted.spread import pb
-from twisted.internet import reactor
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
 
-from helper_audio_recording import record_at_time
+from helper_audio_recording import record_at_time, get_recording_duration, rms_gate
 from helper_audio import load_stereo, load_mono
+from helper_audio_capture import CaptureService, MicrophoneSource
 
 from helper_check_ntp import time_in_sync
-from helper_implementation import generate_key_for_aes, get_possible_fingerprints
+from helper_implementation import get_possible_fingerprints, BackgroundCandidates
 
 from helper_analysis import hamming_distance
+from helper_wire import decode_commitment, decode_fingerprint
+from helper_tracing import span, trace_deferred, trace_iter, enable_tracing
+from implementation_engine import PairingEngine
 
 # Logging all above INFO level, output to stderr
 logging.basicConfig(#format='%(asctime)s %(levelname)-8s %(message)s')
@@ -35,30 +38,43 @@ log.setLevel(logging.DEBUG)
     
 def main():
     # start server
-    reactor.listenTCP(4200, pb.PBServerFactory(PairingServer()))
+    pairing = PairingServer()
+    # record all the time, so recordings are ready without waiting
+    #pairing.capture_service = CaptureService(MicrophoneSource()).start()
+    # write timing of every step, see helper_tracing
+    #enable_tracing("server", "server_trace.jsonl")
+    reactor.listenTCP(4200, pb.PBServerFactory(pairing))
     reactor.run()
 
 class PairingServer(pb.Root):
     def __init__(self):
         """Initialize PairingServer object
+        
+        The attributes are the settings of all pairings, the state of
+        every pairing is kept in its own ``PairingSession``. Fingerprint,
+        code and candidate settings are in ``engine``.
         """
-        self.fingerprint = None
-        self.delta = None
-        self.hash = None
-        self.private_key = None
-        self.recording_data = None
-        self.recording_samplerate = None
         self.recording_use_file = False
         self.recording_file = 'server_recording.wav'
-        self.rs_code_m = 152
-        self.rs_code_n = 512
-        self.rs_code_symsize = 10
+        self.recording_duration = get_recording_duration() # seconds, fingerprint plus alignment margin
+        self.recording_quality_gate = None # like rms_gate(100), records longer if the gate rejects
+        self.recording_max_duration = 9 # seconds, limit for the quality gate
+        self.capture_service = None # always running CaptureService, optional
+        self.engine = PairingEngine() # fingerprinting and fuzzy cryptography
+        self.precompute_candidates = True # generate candidates right after recording
         self.check_ntp = False
         self.debug = False # Using this means NO security!
         self.debug_file = "minimals.txt"
+        self.debug_lock = threading.Lock() # sessions append to debug_file
+        self.debug_files = False # save recording and fingerprint of every session, see PairingSession.debug_filename
+        self.max_sessions = 4 # pairings at the same time
+        self.session_timeout = 60 # seconds without remote call until a session is closed
+        self.agreement_workers = 2 # agreements and candidate generations computed at the same time
+        self.agreement_pool = None
+        self.sessions = {}
+        self.session_ids = count(1)
 
-    
-    def remote_connection(self, device_id):
+    def remote_connection(self, device_id, pairing_id=None):
         """2. Bob accepts or denies connection request
         
         Bob gets ``device_id`` from Alice. Bob tests for correct
@@ -66,23 +82,205 @@ class PairingServer(pb.Root):
         
         :param device_id: String like "Alice"
         :type device_id: str
+        :param pairing_id: Id of the pairing in the traces of Alice, see ``helper_tracing``
+        :type pairing_id: str
+        :return: new ``PairingSession`` if accepted, False if denied
         """
         log.info('2. Bob accepts or denies connection request')
         
         # very very simple implementation to test device_id
-        if device_id == "Alice":
-            if self.check_ntp:
-                # check NTP
-                if not time_in_sync():
-                    log.info('Local time not in sync with NTP')
-                    return False
-                else:
-                    log.info('NTP time ok')
-            return True
-        else:
+        if device_id != "Alice":
             return False
-            
+        
+        if self.check_ntp:
+            # check NTP
+            if not time_in_sync():
+                log.info('Local time not in sync with NTP')
+                return False
+            else:
+                log.info('NTP time ok')
+        
+        if len(self.sessions) >= self.max_sessions:
+            log.info('Too many pairings at the same time: '+str(len(self.sessions)))
+            return False
+        
+        # every pairing gets its own recording and agreement state
+        session = PairingSession(self, self.session_ids.next(), device_id, pairing_id)
+        self.sessions[session.session_id] = session
+        log.info('Session '+str(session.session_id)+' opened, '+str(len(self.sessions))+' active')
+        return session
+
+    def get_agreement_pool(self):
+        """bounded thread pool for the agreements, started on first
+        use and stopped with the reactor
+        
+        :return: ``ThreadPool`` with ``agreement_workers`` threads
+        """
+        if self.agreement_pool is None:
+            self.agreement_pool = ThreadPool(0, self.agreement_workers, 'agreement')
+            self.agreement_pool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.agreement_pool.stop)
+        return self.agreement_pool
+    
+    def close_session(self, session):
+        """forget ``session``, called by ``PairingSession.close``
+        
+        :param session: Closed session
+        :type session: PairingSession
+        """
+        if self.sessions.pop(session.session_id, None) is not None:
+            log.info('Session '+str(session.session_id)+' closed, '+str(len(self.sessions))+' active')
+
+class PairingSession(pb.Referenceable):
+    def __init__(self, pairing_server, session_id, device_id, pairing_id=None):
+        """Initialize PairingSession object
+        
+        State of one pairing with one client. Sessions are closed
+        after ``session_timeout`` seconds without remote calls
+        and when the client disconnects.
+        
+        Recording and agreement block for seconds, so they run in
+        threads and the remote calls answer with Deferreds. Work of
+        a closed session stops at the next candidate fingerprint.
+        
+        :param pairing_server: Reference to ``PairingServer`` object with the settings
+        :type pairing_server: PairingServer
+        :param session_id: Number of this session
+        :type session_id: int
+        :param device_id: String like "Alice"
+        :type device_id: str
+        :param pairing_id: Id of the pairing in the traces
+        :type pairing_id: str
+        """
+        self.pairing_server = pairing_server
+        self.session_id = session_id
+        self.device_id = device_id
+        self.pairing_id = pairing_id or 'session-'+str(session_id)
+        self.fingerprint = None
+        self.reliability = None
+        self.candidates = None
+        self.delta = None
+        self.hash = None
+        self.private_key = None
+        self.recording_data = None
+        self.recording_samplerate = None
+        self.agreement_strategy = None
+        self.closed = False
+        self.cancelled = threading.Event()
+        self.running = 0
+        self.broker = None
+        self.timeout_call = reactor.callLater(pairing_server.session_timeout, self.expire)
+
+    def remoteMessageReceived(self, broker, message, args, kw):
+        """every remote call resets the idle timeout, the session
+        is closed when the connection of the first call is lost
+        """
+        if self.closed:
+            log.info('Session '+str(self.session_id)+' is closed, ignoring '+message)
+            return False
+        if self.broker is None:
+            self.broker = broker
+            broker.notifyOnDisconnect(self.close)
+        self.touch()
+        return pb.Referenceable.remoteMessageReceived(self, broker, message, args, kw)
+
+    def touch(self):
+        """reset the idle timeout, for every request of the client"""
+        self.timeout_call.reset(self.pairing_server.session_timeout)
+
+    def expire(self):
+        """close session after ``session_timeout`` seconds without remote calls"""
+        if self.running:
+            # a long agreement is no idle session
+            self.timeout_call.reset(self.pairing_server.session_timeout)
+            return
+        log.info('Session '+str(self.session_id)+' timed out')
+        self.close()
+
+    def close(self):
+        """close session, remote calls are ignored afterwards"""
+        if self.closed:
+            return
+        self.closed = True
+        self.cancelled.set()
+        if self.candidates is not None:
+            self.candidates.stop()
+        if self.timeout_call.active():
+            self.timeout_call.cancel()
+        if self.broker is not None:
+            self.broker.dontNotifyOnDisconnect(self.close)
+        self.pairing_server.close_session(self)
+    
+    def defer(self, pool, function, *args):
+        """run ``function`` in a thread of ``pool``
+        
+        :return: Deferred with the result, False if the session
+                 was closed before the function started
+        """
+        def run():
+            if self.cancelled.isSet():
+                log.info('Session '+str(self.session_id)+' is closed, skipping '+function.__name__)
+                return False
+            return function(*args)
+        
+        def done(result):
+            self.running -= 1
+            return result
+        
+        self.running += 1
+        deferred = threads.deferToThreadPool(reactor, pool, run)
+        deferred.addBoth(done)
+        return deferred
+    
+    def debug_filename(self, name, extension):
+        """file for debug output of this session, like
+        server_fingerprint_3.txt for session 3
+        
+        :return: filename, None without ``debug_files`` of the server
+        """
+        if not self.pairing_server.debug_files:
+            return None
+        return name+'_'+str(self.session_id)+extension
+    
     def remote_recording(self, start_time):
+        """5. remote recording, see ``record``
+        
+        Recordings wait for ``start_time``, so they use the thread
+        pool of the reactor and not the agreement pool.
+        
+        :return: Deferred with True if recording was successfull
+        """
+        if self.pairing_server.precompute_candidates:
+            # started in the reactor thread, ``prepare_candidates`` uses it
+            self.pairing_server.get_agreement_pool()
+        return self.defer(reactor.getThreadPool(), self.record, start_time)
+    
+    def remote_agreement(self, hash, delta=None):
+        """8. Key Agreement on Server in the agreement pool, see ``agreement``
+        
+        Without ``delta``, ``hash`` is a commitment in the wire format
+        of ``helper_wire.encode_commitment``.
+        
+        :return: Deferred with True if decommit was successfull
+        """
+        if delta is None:
+            hash, delta = decode_commitment(hash)
+        return trace_deferred(self.defer(self.pairing_server.get_agreement_pool(), self.agreement, hash, delta), 'agreement', self.pairing_id)
+    
+    def remote_agreement_debug(self, fingerprint_debug, hash, delta=None):
+        """THIS IS A DEBUG FUNCTION, see ``agreement_debug``
+        
+        Without ``delta``, fingerprint and commitment are in the
+        wire format of ``helper_wire``.
+        
+        :return: Deferred with True if decommit was successfull
+        """
+        if delta is None:
+            fingerprint_debug = decode_fingerprint(fingerprint_debug)
+            hash, delta = decode_commitment(hash)
+        return trace_deferred(self.defer(self.pairing_server.get_agreement_pool(), self.agreement_debug, fingerprint_debug, hash, delta), 'agreement', self.pairing_id)
+
+    def record(self, start_time):
         """5. remote recording
         (4 and 5 are called synchron at ``start_time``)
         
@@ -92,20 +290,39 @@ class PairingServer(pb.Root):
         :type start_time: int
         """
         log.info('5. remote recording')
+        server = self.pairing_server
+        recording_span = span('recording', self.pairing_id)
         
-        if self.recording_use_file:
+        if server.recording_use_file:
             # load recording from file
-            self.recording_data, self.recording_samplerate = load_mono(self.recording_file)
-
-            return True
+            self.recording_data, self.recording_samplerate = load_mono(server.recording_file)
+        elif server.capture_service is not None:
+            # cut recording out of the always running capture
+            self.recording_data, self.recording_samplerate = server.capture_service.get_window(start_time, server.recording_duration)
         else:
             # start recording at start_time
-            self.recording_data, self.recording_samplerate = record_at_time("server.wav", 7, start_time)
-
-            return True
-
+            self.recording_data, self.recording_samplerate = record_at_time(self.debug_filename('server', '.wav'), server.recording_duration, start_time, quality_gate=server.recording_quality_gate, max_duration=server.recording_max_duration)
+        recording_span.end()
         
-    def remote_agreement(self, hash, delta):
+        if server.precompute_candidates:
+            # candidates need no hash and delta, so they are generated
+            # while the client fingerprints and commits
+            self.prepare_candidates()
+        
+        return True
+    
+    def prepare_candidates(self):
+        """calculate fingerprint and reliabilities of the recording and
+        start generating candidate fingerprints in the agreement pool,
+        ``decommit_candidates`` uses them
+        """
+        engine = self.pairing_server.engine
+        with span('fingerprint', self.pairing_id):
+            self.fingerprint, self.reliability = engine.fingerprint(self.recording_data, self.recording_samplerate, reliability=True)
+        candidates = engine.candidates(self.recording_data, self.recording_samplerate, self.fingerprint, self.reliability)
+        self.candidates = BackgroundCandidates(trace_iter(candidates, 'candidate', self.pairing_id)).start(self.pairing_server.agreement_pool)
+        
+    def agreement(self, hash, delta):
         """8. Key Agreement on Server
         generates fingerprint and decommits
         using received ``hash`` and ``delta``
@@ -120,34 +337,22 @@ class PairingServer(pb.Root):
         #===============================================================================
         # Fingerprinting and Fuzzy Cryptography
         #===============================================================================       
-        # generate fingerprint, not used see possible fingerprints
-        self.fingerprint = fingerprint_energy_diff.get_fingerprint(self.recording_data, self.recording_samplerate)
+        if self.candidates is None:
+            # generate fingerprint and the reliabilities of its bits,
+            # already calculated after recording with candidates
+            with span('fingerprint', self.pairing_id):
+                self.fingerprint, self.reliability = self.pairing_server.engine.fingerprint(self.recording_data, self.recording_samplerate, reliability=True)
         
         # save fingerprint for debugging
-        scipy.savetxt("server_fingerprint.txt", self.fingerprint)
+        filename = self.debug_filename('server_fingerprint', '.txt')
+        if filename is not None:
+            scipy.savetxt(filename, self.fingerprint)
 
         log.debug('Bob fingerprint:\n'+str(self.fingerprint))
         
-        # get possible fingerprints
-        possible_fingerprints = get_possible_fingerprints(self.recording_data, self.recording_samplerate)
-                
-        for fingerprint in possible_fingerprints:
-            try:
-                # trying to decommit
-                self.private_key, corr = crypto_fuzzy_jw.JW_decommit(hash, delta, fingerprint, m=self.rs_code_m, n=self.rs_code_n, symsize=self.rs_code_symsize)
-            except Exception, err:
-                log.error('%s' % str(err))
-                
-            else:
-                # if hash is the same accept key agreement,
-                # test is in JW_decommit, try fails when not!
-                # return True for accepted connection
-                return True
-        
-        # if every fingerprint fails to decommit pairing fails
-        return False
+        return self.decommit(hash, delta)
         
-    def remote_agreement_debug(self, fingerprint_debug, hash, delta):
+    def agreement_debug(self, fingerprint_debug, hash, delta):
         """THIS IS A DEBUG FUNCTION
         using the fingerprint from the client
         Using this means NO security!
@@ -162,20 +367,24 @@ class PairingServer(pb.Root):
         :type delta: list
         """
         log.info('8. Key Agreement on Server')
+        server = self.pairing_server
         
         #===============================================================================
         # Fingerprinting and Fuzzy Cryptography
         #===============================================================================       
-        # generate fingerprint, not used see possible fingerprints
-        self.fingerprint = fingerprint_energy_diff.get_fingerprint(self.recording_data, self.recording_samplerate)
+        # generate fingerprint and the reliabilities of its bits
+        with span('fingerprint', self.pairing_id):
+            self.fingerprint, self.reliability = server.engine.fingerprint(self.recording_data, self.recording_samplerate, reliability=True)
         
         # save fingerprint for debugging
-        scipy.savetxt("server_fingerprint.txt", self.fingerprint)
+        filename = self.debug_filename('server_fingerprint', '.txt')
+        if filename is not None:
+            scipy.savetxt(filename, self.fingerprint)
 
         log.debug('Bob fingerprint:\n'+str(self.fingerprint))
         
         # get possible fingerprints
-        possible_fingerprints = get_possible_fingerprints(self.recording_data, self.recording_samplerate)
+        possible_fingerprints = get_possible_fingerprints(self.recording_data, self.recording_samplerate, server.engine.fingerprint_rate)
         
         # DEBUG
         length = len(fingerprint_debug)
@@ -194,33 +403,47 @@ class PairingServer(pb.Root):
         print('Minimal distance: '+str(min_distance)+' of '+str(length))
         print('Minimal correlation percentage: '+str(min_correlation))
         
-        try:
-            minimals = scipy.genfromtxt(self.debug_file)
-        except Exception, err:
-            log.error('%s' % str(err))
-            print('first time, so creating minimals')
-            minimals = scipy.array([])
-        
-        minimals = scipy.hstack((minimals, scipy.array([min_correlation])))
-        scipy.savetxt(self.debug_file, minimals)
-
-        print('saved minimals to file')
-        
-        for fingerprint in possible_fingerprints:
+        with server.debug_lock:
             try:
-                # trying to decommit
-                self.private_key, corr = crypto_fuzzy_jw.JW_decommit(hash, delta, fingerprint, m=self.rs_code_m, n=self.rs_code_n, symsize=self.rs_code_symsize)
+                minimals = scipy.genfromtxt(server.debug_file)
             except Exception, err:
                 log.error('%s' % str(err))
-                
-            else:
-                # if hash is the same accept key agreement,
-                # test is in JW_decommit, try fails when not!
-                # return True for accepted connection
-                return True
+                print('first time, so creating minimals')
+                minimals = scipy.array([])
+            
+            minimals = scipy.hstack((minimals, scipy.array([min_correlation])))
+            scipy.savetxt(server.debug_file, minimals)
+
+        print('saved minimals to file')
+        
+        return self.decommit(hash, delta)
+        
+    def decommit(self, hash, delta):
+        """Try to decommit with the own fingerprint and candidate fingerprints
+        
+        See ``PairingEngine.decommit``, the strategy of the successful
+        fingerprint is saved in ``self.agreement_strategy``. Candidates
+        generated since the recording are used first, see
+        ``prepare_candidates``.
         
-        # if every fingerprint fails to decommit pairing fails
-        return False
+        :param hash: SHA-512 Hash of codeword c
+        :type hash: str
+        :param delta: difference
+        :type delta: list
+        :return: True if decommit was successfull
+        """
+        engine = self.pairing_server.engine
+        if self.candidates is not None:
+            candidates = self.candidates
+        else:
+            candidates = engine.candidates(self.recording_data, self.recording_samplerate, self.fingerprint, self.reliability)
+            candidates = trace_iter(candidates, 'candidate', self.pairing_id)
+        
+        self.private_key, self.agreement_strategy, tried = engine.decommit(hash, delta, self.fingerprint, self.reliability, candidates, cancelled=self.cancelled, session=self.pairing_id)
+        if self.candidates is not None:
+            self.candidates.stop()
+        
+        return self.private_key is not None
         
     def remote_get_data(self):
         """10. get data server object
@@ -234,13 +457,13 @@ class PairingServer(pb.Root):
         return data_server
         
 class DataServer(pb.Referenceable):
-    def __init__(self, pairing_server):
+    def __init__(self, pairing_session):
         """Initialize DataServer object
         
-        :param pairing_server: Reference to ``PairingServer`` object
-        :type pairing_server: PairingServer
+        :param pairing_session: Reference to ``PairingSession`` object with the key
+        :type pairing_session: PairingSession
         """
-        self.pairing_server = pairing_server
+        self.pairing_session = pairing_session
         
     def remote_send_message(self, message):
         """13. send plain message
@@ -255,21 +478,22 @@ class DataServer(pb.Referenceable):
     def remote_send_encrypted_message(self, ciphertext):
         """13. send encrypted plain message
         
+        The pairing is finished afterwards, the session is closed
+        and leaves its place for the next pairing.
+        
         :param ciphertext: Received ciphertext
         :type ciphertext: str
         """
         log.info('13. send encrypted plain message')
         
-        private_key = self.pairing_server.private_key
-
-        # use key to generate key usefull fo aes
-        aes_key = generate_key_for_aes(private_key)
+        private_key = self.pairing_session.private_key
         
         # doing decryption
-        aes_obj = AES.new(aes_key, AES.MODE_ECB)
-        message = aes_obj.decrypt(ciphertext)
+        message = self.pairing_session.pairing_server.engine.decrypt(private_key, ciphertext)
         
         log.info('decrypted message:\n'+repr(message))
+        
+        self.pairing_session.close()
 
 
 if __name__ == '__main__':
@@ -9,7 +9,8 @@
 """
 
 from helper_analysis import hamming_distance
-from helper_audio import load_stereo, load_mono
+from helper_audio import load_stereo, load_mono, enable_cache
+from helper_audio_decoder import decode_files
 import os
 import scipy
 import pickle
@@ -24,28 +25,36 @@ logging.basicConfig(#format='%(asctime)s %(levelname)-8s %(message)s')
 log = logging.getLogger("fuzzy_pairing")
 log.setLevel(logging.DEBUG)
 
+# decode compressed audio files only once
+enable_cache()
+
 
 path = "/home/ds1/Projekte/Fuzzy Pairing Paper/Versuche Audiodateien/"
 
 
 matrix = list()
-      
+
 # get all files in all subdirectories etc.
+filenames = []
 for root, dirs, files in os.walk(path):
     for name in files:
-        filename = os.path.join(root, name)
-        print filename
-       
-        print "current file is: " + name
-        mono_channel, samplerate = load_mono(filename)
-        
-        # fingerprint energy diff
-        fingerprint = fingerprint_energy_diff.get_fingerprint(mono_channel, samplerate)
-        
-        # you can add more analysis using helper_analysis here
-        # and write the results in the matrix for further analyzing
-
-        matrix.append([filename,fingerprint])
+        filenames.append(os.path.join(root, name))
+
+# decode several files at the same time, results come in order of completion
+for filename, result, error in decode_files(filenames, workers=4, read=load_mono):
+    print "current file is: " + filename
+    if error is not None:
+        print "could not load file: " + str(error)
+        continue
+    mono_channel, samplerate = result
+    
+    # fingerprint energy diff
+    fingerprint = fingerprint_energy_diff.get_fingerprint(mono_channel, samplerate)
+    
+    # you can add more analysis using helper_analysis here
+    # and write the results in the matrix for further analyzing
+
+    matrix.append([filename,fingerprint])
 
 print matrix
 
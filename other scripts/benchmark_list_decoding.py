@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of unique decoding against list decoding in JW_decommit
+
+    :platform: Linux
+    :synopsis: Success rate and CPU time of both decoders
+
+Random binary fingerprints are committed with RS(512,152) and decommitted
+with a second fingerprint differing in a growing number of bits, once
+with the unique decoder of the reedsolomon library only and once with
+list decoding as fallback. For every number of bit errors the success
+rate and the mean CPU time per decommit are printed.
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+
+import crypto_fuzzy_jw
+from crypto_list_decoding import get_list_parameters
+import scipy
+import time
+import logging
+from optparse import OptionParser
+
+def flip_bits(fingerprint, count):
+    """copy of ``fingerprint`` with ``count`` random bits inverted"""
+    fingerprint2 = fingerprint.copy()
+    positions = scipy.random.permutation(len(fingerprint))[0:count]
+    fingerprint2[positions] = 1 - fingerprint2[positions]
+    return fingerprint2
+
+def decommit(hash, delta, fingerprint2, m, n, symsize, list_decoding, multiplicity):
+    """decommit and return success and used CPU time"""
+    start = time.clock()
+    try:
+        crypto_fuzzy_jw.JW_decommit(hash, delta, fingerprint2, m=m, n=n, symsize=symsize,
+                                    list_decoding=list_decoding, multiplicity=multiplicity)
+    except RuntimeError:
+        success = False
+    else:
+        success = True
+    return success, time.clock() - start
+
+
+parser = OptionParser(usage='%prog [options]')
+parser.add_option('-t', '--trials', type='int', default=20,
+                  help='decommits per number of bit errors')
+parser.add_option('-m', '--multiplicity', type='int', default=2,
+                  help='multiplicity of the list decoder')
+parser.add_option('-s', '--seed', type='int', default=0,
+                  help='seed for fingerprints and bit errors')
+options, args = parser.parse_args()
+
+# parameters of the pairing
+m = 152
+n = 512
+symsize = 10
+
+# no error messages of failed decommits
+logging.getLogger("fuzzy_pairing").setLevel(logging.CRITICAL)
+
+scipy.random.seed(options.seed)
+degree, list_size, radius = get_list_parameters(n, m, options.multiplicity)
+unique_radius = (n-m) / 2
+print('RS(%d,%d), unique radius %d, list radius %d (multiplicity %d, list size %d)'
+      % (n, m, unique_radius, radius, options.multiplicity, list_size))
+print('%6s | %8s %10s | %8s %10s' % ('errors', 'unique', 'cpu [s]', 'list', 'cpu [s]'))
+
+for errors in range(unique_radius-20, radius+11, 5):
+    unique_successes = list_successes = 0
+    unique_time = list_time = 0.0
+    for trial in range(options.trials):
+        fingerprint1 = scipy.random.randint(0, 2, n)
+        fingerprint2 = flip_bits(fingerprint1, errors)
+        hash, delta, c = crypto_fuzzy_jw.JW_commit(fingerprint1, m=m, n=n, symsize=symsize)
+
+        success, seconds = decommit(hash, delta, fingerprint2, m, n, symsize, False, options.multiplicity)
+        unique_successes += success
+        unique_time += seconds
+
+        success, seconds = decommit(hash, delta, fingerprint2, m, n, symsize, True, options.multiplicity)
+        list_successes += success
+        list_time += seconds
+
+    print('%6d | %7.0f%% %10.4f | %7.0f%% %10.4f'
+          % (errors, 100.0*unique_successes/options.trials, unique_time/options.trials,
+             100.0*list_successes/options.trials, list_time/options.trials))
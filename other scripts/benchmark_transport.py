@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Compare Perspective Broker and the framed protocol on localhost.
+
+    :platform: Linux
+    :synopsis: Benchmark Transport
+
+Runs ``--pairings`` pairings one after another with each transport
+against one ``PairingServer`` in this process, both devices record from
+the given WAV file. Prints round trips per pairing (requests the client
+waits for, without the TCP connect), latency of the pairings and the
+time of the remote calls, see ``helper_tracing``::
+
+    python benchmark_transport.py -p 20 pair.wav
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+import os
+import shutil
+import tempfile
+import numpy
+from optparse import OptionParser
+
+from twisted.spread import pb
+from twisted.internet import reactor, defer
+
+from helper_tracing import enable_tracing, summarize
+from implementation_server import PairingServer
+from implementation_framed import FramedClientProtocol, FramedServerFactory
+from load_test_server import LoadTest
+
+import logging
+log = logging.getLogger("fuzzy_pairing")
+
+# remote calls of the clients
+REMOTE_STAGES = ['connection', 'server_recording', 'agreement', 'get_data', 'send_message']
+
+# requests the clients wait for, counted by the wrappers below
+round_trips = {'pb': 0, 'framed': 0}
+
+def count_pb_calls(method):
+    def counted(*args, **kw):
+        round_trips['pb'] += 1
+        return method(*args, **kw)
+    return counted
+
+def count_framed_requests(request):
+    def counted(self, *args, **kw):
+        # pipelined requests wait in the same round trip
+        if not self.pending:
+            round_trips['framed'] += 1
+        return request(self, *args, **kw)
+    return counted
+
+pb.PBClientFactory.getRootObject = count_pb_calls(pb.PBClientFactory.getRootObject)
+pb.RemoteReference.callRemote = count_pb_calls(pb.RemoteReference.callRemote)
+FramedClientProtocol.request = count_framed_requests(FramedClientProtocol.request)
+
+
+@defer.inlineCallbacks
+def run(ports, recording_file, pairings, results):
+    for transport in ['pb', 'framed']:
+        tracer = enable_tracing(transport)
+        test = LoadTest(ports[transport], [recording_file], pairings, transport=transport)
+        yield test.run()
+        results[transport] = (test, tracer.spans)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] recording.wav')
+    parser.add_option('-p', '--pairings', type='int', default=10,
+                      help='pairings with every transport')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('no recording file')
+
+    logging.basicConfig(format='%(levelname)-8s %(message)s')
+    log.setLevel(logging.WARNING)
+
+    # client and server write debug files into the working directory
+    recording_file = os.path.abspath(args[0])
+    directory = tempfile.mkdtemp(prefix='benchmark_transport_')
+    os.chdir(directory)
+
+    server = PairingServer()
+    server.recording_use_file = True
+    server.recording_file = recording_file
+    ports = {'pb': reactor.listenTCP(0, pb.PBServerFactory(server), interface='127.0.0.1').getHost().port,
+             'framed': reactor.listenTCP(0, FramedServerFactory(server), interface='127.0.0.1').getHost().port}
+
+    results = {}
+    reactor.callWhenRunning(lambda: run(ports, recording_file, options.pairings, results).addBoth(lambda result: reactor.stop()))
+    reactor.run()
+
+    print '%-10s %9s %9s %12s %9s %9s' % ('transport', 'pairings', 'failures', 'round trips', 'p50 ms', 'mean ms')
+    for transport in ['pb', 'framed']:
+        test, spans = results[transport]
+        total = len(test.latencies) + test.failures + test.timeouts
+        latencies = 1000*numpy.array(test.latencies or [numpy.nan])
+        print '%-10s %9d %9d %12.1f %9.1f %9.1f' % (transport, total, test.failures+test.timeouts,
+                                                   float(round_trips[transport])/max(total, 1),
+                                                   numpy.median(latencies), latencies.mean())
+
+    print
+    print 'mean ms of the remote calls'
+    print '%-20s %10s %10s' % ('stage', 'pb', 'framed')
+    summaries = dict((transport, summarize(results[transport][1])) for transport in ['pb', 'framed'])
+    for name in REMOTE_STAGES:
+        values = []
+        for transport in ['pb', 'framed']:
+            s = summaries[transport].get((transport, name))
+            values.append('%10.1f' % (1000*s['mean']) if s else '%10s' % '-')
+        print '%-20s %s %s' % (name, values[0], values[1])
+
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    """run benchmark
+    """
+    main()
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Load test of the PairingServer with simulated clients.
+
+    :platform: Linux
+    :synopsis: Load Test
+
+Runs a ``PairingServer`` and ``--clients`` simulated clients in one
+process on localhost, no microphone and no network is needed. Server
+and clients record from files (``recording_use_file``): the server
+uses the given WAV file, every client a copy of it that is shifted by
+a random time offset of up to ``--offset`` seconds and has white noise
+with a signal to noise ratio of ``--snr`` dB. Every client runs
+``--pairings`` pairings one after another, each over its own connection,
+with Perspective Broker or with ``--transport framed`` over the framed
+protocol of ``implementation_framed``.
+
+At the end throughput, latency percentiles of successful pairings,
+failure rate and the time of every stage (see ``helper_tracing``) are
+printed. Clients and server share the CPU of this process, run it on a
+machine with enough cores or use ``--port`` to load a server that runs
+on its own::
+
+    python load_test_server.py -n 8 -p 5 --offset 0.2 --snr 20 pair.wav
+
+.. moduleauthor:: Dominik Schuermann <d.schuermann@tu-braunschweig.de>
+
+"""
+import os
+import time
+import shutil
+import tempfile
+import numpy
+from scipy.io import wavfile
+from optparse import OptionParser
+
+from twisted.spread import pb
+from twisted.internet import reactor, defer
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+
+from helper_audio import load_mono
+from helper_tracing import enable_tracing, summarize
+from implementation_client import PairingClient
+from implementation_server import PairingServer
+from implementation_framed import FramedPairingClient, FramedClientProtocol, FramedServerFactory
+
+import logging
+log = logging.getLogger("fuzzy_pairing")
+
+
+def simulated_recording(data, samplerate, offset, snr, random=numpy.random):
+    """``data`` shifted by up to ``offset`` seconds with white noise
+
+    :param data: Recording of the server
+    :param samplerate: Samplerate of ``data``
+    :param offset: Maximal time offset in seconds, in both directions
+    :param snr: Signal to noise ratio in dB, None for no noise
+    :return: data -- int16 numpy array
+    """
+    shift = random.randint(-int(offset*samplerate), int(offset*samplerate)+1)
+    data = numpy.asarray(data, dtype=numpy.float64)
+    if shift >= 0:
+        # client started recording later
+        data = data[shift:]
+    else:
+        # client started recording earlier, silence before
+        data = numpy.concatenate((numpy.zeros(-shift), data))
+
+    if snr is not None:
+        signal_power = numpy.mean(numpy.square(data))
+        noise_power = signal_power / 10**(snr/10.0)
+        data = data + random.normal(0, numpy.sqrt(noise_power), len(data))
+
+    return numpy.clip(data, -32768, 32767).astype(numpy.int16)
+
+
+class LoadClientMixin:
+    """reports the result of the pairing with the Deferred ``finished``
+    instead of stopping the reactor, before a client class in the bases
+    """
+    def pairing_done(self, result):
+        PairingClient.pairing_done(self, result)
+        self.finish(True)
+
+    def stop_pairing(self):
+        # like PairingClient.stop_pairing, without stopping the reactor
+        log.error("Pairing failed")
+        self.pairing_span.end(success=False)
+        self.discard_codewords()
+        self.finish(False)
+
+    def finish(self, success):
+        if not self.finished.called:
+            self.finished.callback(success)
+
+class LoadClient(LoadClientMixin, PairingClient):
+    """``PairingClient`` of the load test"""
+    def __init__(self, device_id):
+        PairingClient.__init__(self, device_id)
+        self.finished = defer.Deferred()
+
+class FramedLoadClient(LoadClientMixin, FramedPairingClient):
+    """``FramedPairingClient`` of the load test"""
+    def __init__(self, device_id):
+        FramedPairingClient.__init__(self, device_id)
+        self.finished = defer.Deferred()
+
+
+class LoadTest(object):
+    """Simulated clients and their results
+
+    :param port: Port of the ``PairingServer`` on localhost
+    :param recording_files: One recording file for every client
+    :param pairings: Pairings of every client
+    :param timeout: Seconds until an unfinished pairing counts as timed out
+    :param transport: "pb" or "framed"
+    """
+    def __init__(self, port, recording_files, pairings=1, timeout=60, transport='pb'):
+        self.port = port
+        self.transport = transport
+        self.recording_files = recording_files
+        self.pairings = pairings
+        self.timeout = timeout
+        self.latencies = [] # seconds of successful pairings
+        self.failures = 0
+        self.timeouts = 0
+        self.start_time = None
+        self.end_time = None
+
+    def run(self):
+        """start all clients, fires when all pairings are finished"""
+        self.start_time = time.time()
+        clients = [self.run_client(filename) for filename in self.recording_files]
+        finished = defer.DeferredList(clients)
+        finished.addCallback(self.stop)
+        return finished
+
+    @defer.inlineCallbacks
+    def run_client(self, recording_file):
+        for i in range(self.pairings):
+            yield self.pair(recording_file)
+
+    def pair(self, recording_file):
+        """one pairing over a new connection"""
+        start = time.time()
+        if self.transport == 'framed':
+            client = FramedLoadClient(device_id="Alice")
+            connected = connectProtocol(TCP4ClientEndpoint(reactor, "localhost", self.port), FramedClientProtocol())
+            def disconnect():
+                if client.protocol is not None:
+                    client.protocol.transport.loseConnection()
+        else:
+            client = LoadClient(device_id="Alice")
+            factory = pb.PBClientFactory()
+            reactor.connectTCP("localhost", self.port, factory)
+            connected = factory.getRootObject()
+            disconnect = factory.disconnect
+        client.recording_use_file = True
+        client.recording_file = recording_file
+        connected.addCallbacks(client.request_connection, client.pairing_error)
+
+        timeout_call = reactor.callLater(self.timeout, self.timed_out, client)
+
+        def finished(success):
+            if timeout_call.active():
+                timeout_call.cancel()
+            if success:
+                self.latencies.append(time.time()-start)
+            elif success is False:
+                self.failures += 1
+            disconnect()
+        client.finished.addCallback(finished)
+        return client.finished
+
+    def timed_out(self, client):
+        log.error('Pairing timed out')
+        self.timeouts += 1
+        client.finished.callback(None)
+
+    def stop(self, results):
+        self.end_time = time.time()
+
+    def report(self):
+        """print throughput, latencies and failure rate"""
+        total = len(self.latencies) + self.failures + self.timeouts
+        duration = self.end_time - self.start_time
+        print 'pairings:    %d in %.1f s with %d clients' % (total, duration, len(self.recording_files))
+        print 'throughput:  %.2f successful pairings/s' % (len(self.latencies)/duration)
+        print 'failures:    %d failed, %d timed out, failure rate %.1f %%' % (self.failures, self.timeouts, 100.0*(self.failures+self.timeouts)/max(total, 1))
+        if self.latencies:
+            latencies = 1000*numpy.array(self.latencies)
+            print 'latency ms:  p50 %.0f  p90 %.0f  p95 %.0f  p99 %.0f  max %.0f' % tuple(
+                    [numpy.percentile(latencies, p) for p in (50, 90, 95, 99)] + [latencies.max()])
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] recording.wav')
+    parser.add_option('-n', '--clients', type='int', default=4,
+                      help='clients pairing at the same time')
+    parser.add_option('-p', '--pairings', type='int', default=1,
+                      help='pairings of every client')
+    parser.add_option('--offset', type='float', default=0.1,
+                      help='maximal time offset of the clients in seconds')
+    parser.add_option('--snr', type='float', default=None,
+                      help='signal to noise ratio of the clients in dB, default no noise')
+    parser.add_option('--max-sessions', type='int', default=None,
+                      help='pairings the server accepts at the same time, default of PairingServer')
+    parser.add_option('--timeout', type='float', default=60,
+                      help='seconds until a pairing counts as timed out')
+    parser.add_option('--transport', type='choice', choices=['pb', 'framed'], default='pb',
+                      help='pb (Perspective Broker) or framed, see implementation_framed')
+    parser.add_option('--port', type='int', default=None,
+                      help='port of a running server on localhost, default a server in this process')
+    parser.add_option('--seed', type='int', default=None,
+                      help='seed of offsets and noise')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('no recording file')
+
+    logging.basicConfig(format='%(levelname)-8s %(message)s')
+    log.setLevel(logging.WARNING)
+
+    numpy.random.seed(options.seed)
+    data, samplerate = load_mono(args[0])
+
+    # client and server write debug files into the working directory
+    directory = tempfile.mkdtemp(prefix='load_test_')
+    recording_file = os.path.abspath(args[0])
+    os.chdir(directory)
+
+    recording_files = []
+    for i in range(options.clients):
+        filename = os.path.join(directory, 'client_'+str(i)+'.wav')
+        wavfile.write(filename, samplerate, simulated_recording(data, samplerate, options.offset, options.snr))
+        recording_files.append(filename)
+
+    port = options.port
+    if port is None:
+        server = PairingServer()
+        server.recording_use_file = True
+        server.recording_file = recording_file
+        if options.max_sessions is not None:
+            server.max_sessions = options.max_sessions
+        if options.transport == 'framed':
+            factory = FramedServerFactory(server)
+        else:
+            factory = pb.PBServerFactory(server)
+        port = reactor.listenTCP(0, factory, interface='127.0.0.1').getHost().port
+
+    # recordings and commitments of all clients run in threads
+    reactor.suggestThreadPoolSize(max(10, 2*options.clients))
+
+    tracer = enable_tracing('load')
+    test = LoadTest(port, recording_files, options.pairings, options.timeout, options.transport)
+    reactor.callWhenRunning(lambda: test.run().addBoth(lambda result: reactor.stop()))
+    reactor.run()
+
+    test.report()
+    print
+    if options.port is None:
+        print 'stages of clients and server together, see helper_tracing'
+    print '%-24s %7s %10s %10s' % ('stage', 'count', 'mean ms', 'p95 ms')
+    for (source, name), s in sorted(summarize(tracer.spans).items()):
+        print '%-24s %7d %10.1f %10.1f' % (name, s['count'], 1000*s['mean'], 1000*s['p95'])
+
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    """run load test
+    """
+    main()
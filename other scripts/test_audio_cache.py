@@ -0,0 +1,48 @@
+"""Test for the on-disk cache of decoded audio
+
+>>> import os, time, tempfile, shutil, numpy
+>>> from helper_audio_cache import AudioCache
+>>> directory = tempfile.mkdtemp()
+>>> sources = []
+>>> for i in range(3):
+...     handle, source = tempfile.mkstemp(dir=directory, suffix='.mp3')
+...     written = os.write(handle, str(i))
+...     os.close(handle)
+...     sources.append(source)
+>>> cache = AudioCache(os.path.join(directory, 'cache'), max_bytes=2500)
+>>> data = numpy.zeros(500, dtype=numpy.int16)
+>>> cache.put(sources[0], data, 1.0, 1, 500)
+>>> data, duration, channels, samplerate = cache.get(sources[0])
+>>> len(data), duration, channels, samplerate
+(500, 1.0, 1, 500)
+
+The least recently used entry is removed, never the one just added:
+
+>>> time.sleep(0.01)
+>>> cache.put(sources[1], numpy.zeros(500, dtype=numpy.int16), 1.0, 1, 500)
+>>> time.sleep(0.01)
+>>> cache.put(sources[2], numpy.zeros(500, dtype=numpy.int16), 1.0, 1, 500)
+>>> [cache.get(source) is not None for source in sources]
+[False, True, True]
+>>> time.sleep(0.01)
+>>> cache.put(sources[0], numpy.zeros(1200, dtype=numpy.int16), 2.4, 1, 500)
+>>> [cache.get(source) is not None for source in sources]
+[True, False, False]
+
+Audio larger than the whole cache is not written:
+
+>>> cache.put(sources[1], numpy.zeros(2000, dtype=numpy.int16), 4.0, 1, 500)
+>>> cache.get(sources[1]) is None
+True
+>>> cache.get(sources[0]) is not None
+True
+>>> shutil.rmtree(directory)
+"""
+
+def _test():
+    import doctest, test_audio_cache
+    return doctest.testmod(test_audio_cache)
+
+if __name__ == "__main__":
+    failed, attempts = _test()
+    print '%d/%d passed' % (attempts - failed, attempts)
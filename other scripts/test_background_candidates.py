@@ -0,0 +1,87 @@
+"""Test for the candidates generated in the agreement pool
+
+>>> from twisted.python.threadpool import ThreadPool
+>>> from helper_implementation import BackgroundCandidates
+>>> pool = ThreadPool(0, 1)
+>>> pool.start()
+>>> candidates = BackgroundCandidates(iter(range(5))).start(pool)
+>>> list(candidates)
+[0, 1, 2, 3, 4]
+
+Every iteration starts at the first candidate:
+
+>>> list(candidates)
+[0, 1, 2, 3, 4]
+
+An agreement in the only thread of the pool generates its candidates
+itself instead of waiting for the tasks behind it:
+
+>>> import threading
+>>> results = []
+>>> finished = threading.Event()
+>>> def agreement():
+...     candidates = BackgroundCandidates(iter(range(5))).start(pool)
+...     results.append(list(candidates))
+...     finished.set()
+>>> pool.callInThread(agreement)
+>>> finished.wait(10)
+True
+>>> results
+[[0, 1, 2, 3, 4]]
+
+Tasks wait while the iteration generates, one task per candidate:
+
+>>> import time
+>>> def slow(count):
+...     for i in range(count):
+...         time.sleep(0.01)
+...         yield i
+>>> candidates = BackgroundCandidates(slow(20))
+>>> tasks = []
+>>> def counted(pool, run_task=candidates._run_task):
+...     tasks.append(pool)
+...     run_task(pool)
+>>> candidates._run_task = counted
+>>> candidates.start(pool) is candidates
+True
+>>> list(candidates) == range(20)
+True
+>>> time.sleep(0.1)
+>>> len(tasks) <= 21
+True
+
+In an own thread, too, thread and iteration together take one step
+per candidate and one each to find the end:
+
+>>> candidates = BackgroundCandidates(slow(20))
+>>> steps = []
+>>> def counted(step=candidates._step):
+...     steps.append(None)
+...     return step()
+>>> candidates._step = counted
+>>> candidates.start() is candidates
+True
+>>> list(candidates) == range(20)
+True
+>>> time.sleep(0.1)
+>>> len(steps) <= 22
+True
+
+Stopped candidates keep the ones ready until then:
+
+>>> candidates = BackgroundCandidates(iter(range(5)))
+>>> candidates.stop()
+>>> candidates.start(pool) is candidates
+True
+>>> list(candidates)
+[]
+>>> pool.stop()
+"""
+
+def _test():
+    import doctest, test_background_candidates
+    return doctest.testmod(test_background_candidates)
+
+if __name__ == "__main__":
+    failed, attempts = _test()
+    print '%d/%d passed' % (attempts - failed, attempts)
@@ -0,0 +1,63 @@
+"""Test for the ring buffer of the capture service
+
+>>> from helper_audio_capture import RingBuffer
+>>> ring = RingBuffer(10, 100)
+>>> ring.write(range(200), 1000.0)
+>>> list(ring.get_window(1000.5, 0.1))
+[50, 51, 52, 53, 54, 55, 56, 57, 58, 59]
+
+A window before the first sample has no samples:
+
+>>> ring.get_window(999.0, 2)
+Traceback (most recent call last):
+  ...
+ValueError: Samples are not in the ring buffer
+>>> ring.read(-1, 2)
+Traceback (most recent call last):
+  ...
+ValueError: Samples are not in the ring buffer
+
+Old samples are overwritten:
+
+>>> ring.write(range(200, 1100))
+>>> ring.read(99, 2)
+Traceback (most recent call last):
+  ...
+ValueError: Samples are not in the ring buffer
+>>> list(ring.read(100, 3))
+[100, 101, 102]
+>>> list(ring.read(1097, 3))
+[1097, 1098, 1099]
+>>> ring.read(1099, 2)
+Traceback (most recent call last):
+  ...
+ValueError: Samples are not recorded yet
+
+Other processes attach to a ring buffer in a file:
+
+>>> import os, tempfile
+>>> filename = os.path.join(tempfile.mkdtemp(), 'ring.shm')
+>>> ring = RingBuffer(10, 100, filename)
+>>> ring.write(range(200), 1000.0)
+>>> attached = RingBuffer.attach(filename)
+>>> attached.capacity, attached.samplerate
+(1000, 100)
+>>> list(attached.get_window(1001.0, 0.05))
+[100, 101, 102, 103, 104]
+>>> ring.write(range(200, 300))
+>>> attached.written
+300
+>>> attached.write(range(10))
+Traceback (most recent call last):
+  ...
+RuntimeError: Ring buffer is attached read only
+>>> os.remove(filename)
+"""
+
+def _test():
+    import doctest, test_capture
+    return doctest.testmod(test_capture)
+
+if __name__ == "__main__":
+    failed, attempts = _test()
+    print '%d/%d passed' % (attempts - failed, attempts)
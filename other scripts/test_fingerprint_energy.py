@@ -9,7 +9,7 @@
 """
 
 from helper_analysis import hamming_distance
-from helper_audio import load_mono
+from helper_audio import load_mono, enable_cache
  
 
 base = "/home/ds1/Projekte/Bachelorarbeit/Program/recordings/"
@@ -24,6 +24,9 @@ logging.basicConfig(#format='%(asctime)s %(levelname)-8s %(message)s')
 log = logging.getLogger("fuzzy_pairing")
 log.setLevel(logging.DEBUG)
 
+# decode compressed audio files only once
+enable_cache()
+
 
 # load channels:
 left_channel, samplerate = load_mono(base+'1.5_3/high/music5.wav')
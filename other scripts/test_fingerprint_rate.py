@@ -0,0 +1,54 @@
+"""Test for fingerprints of decimated data
+
+Every frame after the first one gives one bit less than it has frequency
+bands, at full samplerate and at the fingerprint rate 32 bits:
+
+>>> import numpy
+>>> import fingerprint_energy_diff
+>>> numpy.random.seed(0)
+>>> data = numpy.random.randint(-10000, 10000, 7*44100)
+>>> frames = len(fingerprint_energy_diff.get_frames(data, 44100))
+>>> frames
+18
+
+``calculate_difference`` prints the number of frames:
+
+>>> fingerprint = fingerprint_energy_diff.calculate_fingerprint(data, 44100)
+18
+>>> len(fingerprint) == (frames-1)*32
+True
+>>> fingerprint = fingerprint_energy_diff.calculate_fingerprint(data, 44100, fingerprint_rate=5512.5)
+18
+>>> len(fingerprint) == (frames-1)*32
+True
+>>> fingerprint = fingerprint_energy_diff.calculate_fingerprint(data, 44100, fingerprint_rate=11025)
+18
+>>> len(fingerprint) == (frames-1)*32
+True
+
+The required samples give 512 bits at the fingerprint rate, too:
+
+>>> samples = fingerprint_energy_diff.get_required_samples(44100, fingerprint_rate=5512.5)
+>>> fingerprint = fingerprint_energy_diff.get_fingerprint(data[:samples], 44100, fingerprint_rate=5512.5)
+17
+>>> len(fingerprint)
+512
+
+Data is resampled to exactly the fingerprint rate:
+
+>>> fingerprint_energy_diff.get_resample_ratio(44100, 5512.5)
+(1, 8)
+>>> fingerprint_energy_diff.get_resample_ratio(48000, 5512.5)
+(147, 1280)
+>>> resampled, rate = fingerprint_energy_diff.resample(data[:48000], 48000, 5512.5)
+>>> rate, len(resampled)
+(5512.5, 5513)
+"""
+
+def _test():
+    import doctest, test_fingerprint_rate
+    return doctest.testmod(test_fingerprint_rate)
+
+if __name__ == "__main__":
+    failed, attempts = _test()
+    print '%d/%d passed' % (attempts - failed, attempts)
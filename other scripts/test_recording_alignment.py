@@ -0,0 +1,32 @@
+"""Test for the alignment of recordings to their start time
+
+>>> import numpy
+>>> from helper_audio_recording import align_to_start
+>>> data = numpy.arange(1, 11, dtype=numpy.int16)
+
+Samples captured before the start time are dropped:
+
+>>> list(align_to_start(data, 100, 999.97, 1000.0))
+[4, 5, 6, 7, 8, 9, 10]
+
+A late start is padded with zeros:
+
+>>> aligned = align_to_start(data, 100, 1000.02, 1000.0)
+>>> list(aligned)
+[0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+>>> aligned.dtype
+dtype('int16')
+
+Delays longer than the startup slack are not aligned:
+
+>>> align_to_start(data, 100, 1002.0, 1000.0) is data
+True
+"""
+
+def _test():
+    import doctest, test_recording_alignment
+    return doctest.testmod(test_recording_alignment)
+
+if __name__ == "__main__":
+    failed, attempts = _test()
+    print '%d/%d passed' % (attempts - failed, attempts)
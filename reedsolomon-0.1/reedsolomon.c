@@ -815,6 +815,281 @@ stringcodec_updatechunk(Codec *self, PyObject *args)
 }
 
 
+/*
+ * Get a contiguous view of a chunk buffer.  Objects supporting the
+ * new buffer interface (str, bytearray, memoryview, numpy arrays) are
+ * used directly and can not be resized while the view is held;
+ * objects providing only the old interface (mmap, array) are
+ * wrapped, so the view can always be released with
+ * PyBuffer_Release().  Nothing keeps the memory of old style buffers
+ * valid, e.g. an array may be resized or an mmap closed, so
+ * *old_buffers is set for them and the caller must hold the GIL
+ * while using the memory.
+ */
+static int
+get_chunk_buffer(PyObject *o, int writable, Py_buffer *view,
+                 int *old_buffers)
+{
+    void *ptr;
+    Py_ssize_t len;
+
+    if (PyObject_CheckBuffer(o))
+        return PyObject_GetBuffer(o, view,
+                                  writable ? PyBUF_WRITABLE : PyBUF_SIMPLE);
+    *old_buffers = 1;
+    if (writable) {
+        if (PyObject_AsWriteBuffer(o, &ptr, &len) < 0)
+            return -1;
+    }
+    else {
+        if (PyObject_AsReadBuffer(o, (const void **) &ptr, &len) < 0)
+            return -1;
+    }
+    return PyBuffer_FillInfo(view, o, ptr, len, !writable, PyBUF_SIMPLE);
+}
+
+
+/*
+ * Get views of all chunk buffers in a sequence.  Views are stored in
+ * views[offset:offset+count] and pointers to their memory in ptrs.
+ * *acquired is incremented for every view, so the caller can release
+ * exactly the acquired views on error.  If check is set, the symbols
+ * in the buffers are sanity-checked.  *old_buffers is set if any
+ * buffer has only the old interface, see get_chunk_buffer().
+ */
+static int
+get_chunk_buffers(Codec *self, PyObject *seq, int count, int writable,
+                  int check, Py_buffer *views, int offset,
+                  unsigned char **ptrs, Py_ssize_t *rows, int *acquired,
+                  int *old_buffers)
+{
+    PyObject *o;
+    int i, res;
+    Py_ssize_t length;
+
+    length = PySequence_Size(seq);
+    if (length < 0) {
+        PyErr_SetString(PyExc_TypeError, "Input must be a sequence");
+        return -1;
+    }
+    if (length != count) {
+        PyErr_Format(PyExc_ValueError,
+                     "Expected %d buffers, but got %d buffers",
+                     count, (int) length);
+        return -1;
+    }
+    for (i = 0; i < count; i++) {
+        o = PySequence_GetItem(seq, i);
+        if (!o)
+            return -1;
+        res = get_chunk_buffer(o, writable, &views[offset + i],
+                               old_buffers);
+        Py_DECREF(o);
+        if (res < 0)
+            return -1;
+        (*acquired)++;
+        if (*rows == -1)
+            *rows = views[offset + i].len;
+        else if (*rows != views[offset + i].len) {
+            PyErr_SetString(PyExc_ValueError,
+                            "The buffers have unequal length");
+            return -1;
+        }
+        ptrs[offset + i] = (unsigned char *) views[offset + i].buf;
+        if (check && stringcodec_checksymbols(self, ptrs[offset + i],
+                                              views[offset + i].len) < 0)
+            return -1;
+    }
+    return 0;
+}
+
+
+static char stringcodec_encodebuffers_doc[] =
+"encodebuffers(data_buffers, parity_buffers) -> None\n"
+"\n"
+"Encode interleaved chunks in place.\n"
+"Like encodechunks(), but the chunks may be any objects supporting\n"
+"the buffer interface, e.g. str, bytearray, memoryview or mmap.\n"
+"data_buffers must contain self.k readable buffers and\n"
+"parity_buffers self.nroots writable buffers, all having the same\n"
+"length.  The parity chunks are written into parity_buffers;\n"
+"no chunk is copied or allocated.  The GIL is released while\n"
+"encoding, unless a buffer supports only the old buffer interface\n"
+"(e.g. mmap or array).\n";
+
+static PyObject *
+stringcodec_encodebuffers(Codec *self, PyObject *args)
+{
+    PyObject *data_seq, *parity_seq;
+    Py_buffer *views = NULL;
+    int acquired = 0, old_buffers = 0, i, j;
+    Py_ssize_t row, rows = -1;
+    PyThreadState *save = NULL;
+    /* 256 is enough as long as self->n <= 255 */
+    unsigned char data_str[256], parity_str[256];
+    unsigned char *ptrs[256];
+    unsigned char **inputs = ptrs, **outputs = ptrs + self->k;
+    int k = self->k, nroots = self->nroots;
+    PyObject *res = NULL;
+
+    if (!PyArg_ParseTuple(args, "OO", &data_seq, &parity_seq))
+        return NULL;
+    views = (Py_buffer *) PyMem_Malloc(sizeof(Py_buffer) * self->n);
+    if (!views)
+        return PyErr_NoMemory();
+    if (get_chunk_buffers(self, data_seq, k, 0, 1, views, 0, ptrs,
+                          &rows, &acquired, &old_buffers) < 0)
+        goto error;
+    if (get_chunk_buffers(self, parity_seq, nroots, 1, 0, views, k, ptrs,
+                          &rows, &acquired, &old_buffers) < 0)
+        goto error;
+
+    /* Do the real work, old style buffers are only valid with the GIL */
+    if (!old_buffers)
+        save = PyEval_SaveThread();
+    for (row = 0; row < rows; row++) {
+        for (j = 0; j < k; j++)
+            data_str[j] = inputs[j][row];
+        self->char_encode(self, data_str, parity_str);
+        for (j = 0; j < nroots; j++)
+            outputs[j][row] = parity_str[j];
+    }
+    if (save)
+        PyEval_RestoreThread(save);
+
+    Py_INCREF(Py_None);
+    res = Py_None;
+
+ error:
+    for (i = 0; i < acquired; i++)
+        PyBuffer_Release(&views[i]);
+    PyMem_Free(views);
+    return res;
+}
+
+
+static char stringcodec_decodebuffers_doc[] =
+"decodebuffers(buffers [,erasures]) -> corrections\n"
+"\n"
+"Decode interleaved chunks in place.\n"
+"Like decodechunks(), but the chunks may be any writable objects\n"
+"supporting the buffer interface, e.g. bytearray, memoryview or\n"
+"mmap.  buffers must contain self.n buffers of the same length.\n"
+"Corrected symbols are written back into the buffers, data and\n"
+"parity alike; no chunk is copied or allocated.  Returns a union\n"
+"of the indexes of corrections made in any code word.  If\n"
+"UncorrectableError is raised, code words before the failing one\n"
+"have already been corrected.  The GIL is released while decoding,\n"
+"unless a buffer supports only the old buffer interface (e.g. mmap\n"
+"or array).\n";
+
+static PyObject *
+stringcodec_decodebuffers(Codec *self, PyObject *args)
+{
+    PyObject *seq, *o, *erasures = NULL;
+    PyObject *corrections = NULL, *res = NULL;
+    Py_buffer *views = NULL;
+    int acquired = 0, old_buffers = 0, i, j, index, failed = 0;
+    int no_eras, eras_array_size, count;
+    int *eras_pos = NULL, *const_eras_pos = NULL;
+    Py_ssize_t row, rows = -1;
+    PyThreadState *save = NULL;
+    /* 256 is enough as long as self->n <= 255 */
+    unsigned char codeword[256], corrected[256];
+    unsigned char *chunks[256];
+    int n = self->n;
+
+    if (!PyArg_ParseTuple(args, "O|O", &seq, &erasures))
+        return NULL;
+    views = (Py_buffer *) PyMem_Malloc(sizeof(Py_buffer) * n);
+    if (!views)
+        return PyErr_NoMemory();
+    if (get_chunk_buffers(self, seq, n, 1, 1, views, 0, chunks,
+                          &rows, &acquired, &old_buffers) < 0)
+        goto error;
+    if (!(const_eras_pos = create_erasure_array(self, erasures, &no_eras,
+                                                &eras_array_size)))
+        goto error;
+    if (!(eras_pos = PyMem_Malloc(eras_array_size)))
+        goto error;
+
+    codeword[n] = 0;
+    memset(corrected, 0, n);
+
+    /* Do the real work, old style buffers are only valid with the GIL */
+    if (!old_buffers)
+        save = PyEval_SaveThread();
+    for (row = 0; row < rows; row++) {
+        for (j = 0; j < n; j++)
+            codeword[j] = chunks[j][row];
+        memcpy(eras_pos, const_eras_pos, eras_array_size);
+        count = self->char_decode(self, codeword, eras_pos, no_eras);
+        if (count < 0) {
+            failed = 1;
+            break;
+        }
+        /* Check all indexes before touching the buffers */
+        for (j = 0; j < count; j++) {
+            index = eras_pos[j] - self->pad;
+            if (index < 0 || index >= n) {
+                /* Tried to correct an impossible index */
+                failed = 2;
+                break;
+            }
+        }
+        if (failed)
+            break;
+        for (j = 0; j < count; j++) {
+            index = eras_pos[j] - self->pad;
+            chunks[index][row] = codeword[index];
+            corrected[index] = 1;
+        }
+    }
+    if (save)
+        PyEval_RestoreThread(save);
+
+    if (failed == 1) {
+        PyErr_SetString(UncorrectableError,
+                        "Too many errors or erasures in input");
+        goto error;
+    }
+    if (failed == 2) {
+        PyErr_SetString(UncorrectableError, "Corrupted input");
+        goto error;
+    }
+
+    /* Construct the return value */
+    corrections = PyList_New(0);
+    if (!corrections)
+        goto error;
+    for (i = 0; i < n; i++) {
+        if (corrected[i]) {
+            o = PyInt_FromLong(i);
+            if (!o)
+                goto error;
+            if (PyList_Append(corrections, o) < 0) {
+                Py_DECREF(o);
+                goto error;
+            }
+            Py_DECREF(o);
+        }
+    }
+    res = corrections;
+    corrections = NULL;
+
+ error:
+    Py_XDECREF(corrections);
+    for (i = 0; i < acquired; i++)
+        PyBuffer_Release(&views[i]);
+    PyMem_Free(views);
+    if (eras_pos)
+        PyMem_Free(eras_pos);
+    if (const_eras_pos)
+        PyMem_Free(const_eras_pos);
+    return res;
+}
+
+
 static char intcodec_doc[] = 
 "Reed-Solomon integer array encoder/decoder\n"
 "\n"
@@ -1075,6 +1350,10 @@ static PyMethodDef stringcodec_methods[] = {
      stringcodec_decodechunks_doc},
     {"updatechunk", (PyCFunction)stringcodec_updatechunk, METH_VARARGS,
      stringcodec_updatechunk_doc},
+    {"encodebuffers", (PyCFunction)stringcodec_encodebuffers, METH_VARARGS,
+     stringcodec_encodebuffers_doc},
+    {"decodebuffers", (PyCFunction)stringcodec_decodebuffers, METH_VARARGS,
+     stringcodec_decodebuffers_doc},
     {NULL}
 };
 
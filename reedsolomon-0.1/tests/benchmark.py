@@ -0,0 +1,193 @@
+
+"""
+Decode benchmark for IntegerCodec at the parameters used for pairing.
+
+speedtest.py measures bulk string chunk throughput.  This script
+measures what the fuzzy pairing actually does: decoding single
+IntegerCodec code words, most prominently RS(512, 152) with 10 bit
+symbols, while a growing number of symbol errors is injected.  Error
+counts beyond the correction radius (n - k) / 2 are included, so the
+cost of uncorrectable input is measured as well.
+
+For every (n, k, symsize) point and error count the script reports
+decodes per second and how many decodes were corrected, miscorrected
+(decoded to a different code word) or rejected.  Allocation overhead
+is reported as the number of bytes held by the Python objects every
+decode returns, and as the growth of the maximum resident set size.
+
+Results are written as JSON, so two builds can be compared:
+
+  python benchmark.py -o old.json
+  (rebuild)
+  python benchmark.py -o new.json --compare old.json
+"""
+
+import reedsolomon
+import random
+import resource
+import platform
+import time
+import sys
+import json
+from optparse import OptionParser
+
+# (n, k, symsize), the first one is the pairing code
+POINTS = [
+    (512, 152, 10),
+    (512, 256, 10),
+    (1023, 511, 10),
+    (255, 223, 8),
+    (20, 15, 8),
+]
+
+# injected errors as fraction of the correction radius (n - k) / 2
+ERROR_FRACTIONS = [0.0, 0.25, 0.5, 0.75, 1.0, 1.1, 1.5]
+
+
+def maxrss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def result_size(res):
+    """bytes held by the objects returned from one decode"""
+    decoded, corrections = res
+    size = sys.getsizeof(res) + sys.getsizeof(decoded) + \
+           sys.getsizeof(corrections)
+    size += sum([sys.getsizeof(v) for v in decoded])
+    size += sum([sys.getsizeof(v) for v in corrections])
+    return size
+
+def make_words(c, count, errors, rnd):
+    """random code words with ``errors`` corrupted symbols each"""
+    words = []
+    for i in range(count):
+        message = [rnd.randrange(1 << c.symsize) for j in range(c.k)]
+        received = c.encode(message)
+        for pos in rnd.sample(range(c.n), errors):
+            received[pos] ^= rnd.randrange(1, 1 << c.symsize)
+        words.append((message, received))
+    return words
+
+def bench_point(n, k, symsize, min_time, words_per_round, rnd):
+    c = reedsolomon.IntegerCodec(n, k, symsize)
+    radius = (n - k) // 2
+    counts = []
+    for fraction in ERROR_FRACTIONS:
+        errors = min(n, int(round(radius * fraction)))
+        if errors not in counts:
+            counts.append(errors)
+
+    results = []
+    for errors in counts:
+        corrected = miscorrected = failed = 0
+        decodes = 0
+        alloc = 0
+        elapsed = 0.0
+        rss_before = maxrss_kib()
+        while elapsed < min_time:
+            words = make_words(c, words_per_round, errors, rnd)
+            outcomes = []
+            # only the decodes are timed
+            start = time.time()
+            for message, received in words:
+                try:
+                    outcomes.append(c.decode(received))
+                except reedsolomon.UncorrectableError:
+                    outcomes.append(None)
+            elapsed += time.time() - start
+            decodes += len(words)
+            for (message, received), res in zip(words, outcomes):
+                if res is None:
+                    failed += 1
+                    continue
+                alloc += result_size(res)
+                if res[0] == message:
+                    corrected += 1
+                else:
+                    miscorrected += 1
+        results.append({
+            'errors': errors,
+            'decodes': decodes,
+            'seconds': elapsed,
+            'decodes_per_second': decodes / elapsed,
+            'corrected': corrected,
+            'miscorrected': miscorrected,
+            'failed': failed,
+            'result_bytes_per_decode': alloc / max(1, decodes - failed),
+            'maxrss_growth_kib': maxrss_kib() - rss_before,
+        })
+    return {'n': n, 'k': k, 'symsize': symsize, 'radius': radius,
+            'codec': repr(c), 'results': results}
+
+def compare(old, new):
+    """print decode rate changes between two result sets"""
+    old_rates = {}
+    for point in old['points']:
+        for r in point['results']:
+            key = (point['n'], point['k'], point['symsize'], r['errors'])
+            old_rates[key] = r['decodes_per_second']
+    for point in new['points']:
+        for r in point['results']:
+            key = (point['n'], point['k'], point['symsize'], r['errors'])
+            if key not in old_rates:
+                continue
+            change = r['decodes_per_second'] / old_rates[key] - 1.0
+            print >> sys.stderr, \
+                'RS(%d,%d) symsize=%d errors=%4d: %+6.1f %%' % (
+                    key + (change * 100,))
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', default=None,
+                      help='write JSON results to this file (default stdout)')
+    parser.add_option('-t', '--min-time', type='float', default=0.5,
+                      help='minimal decode time per error count in seconds')
+    parser.add_option('-w', '--words', type='int', default=50,
+                      help='code words generated per timing round')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='seed for the error injection')
+    parser.add_option('-p', '--pairing-only', action='store_true',
+                      default=False, help='only benchmark RS(512, 152)')
+    parser.add_option('-c', '--compare', default=None,
+                      help='JSON file of a previous run to compare with')
+    options, args = parser.parse_args()
+
+    rnd = random.Random(options.seed)
+    points = POINTS
+    if options.pairing_only:
+        points = POINTS[:1]
+
+    report = {
+        'module': reedsolomon.__file__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'time': time.time(),
+        'seed': options.seed,
+        'points': [],
+    }
+    for n, k, symsize in points:
+        print >> sys.stderr, 'benchmarking RS(%d,%d) symsize=%d' % (
+            n, k, symsize)
+        report['points'].append(bench_point(n, k, symsize, options.min_time,
+                                            options.words, rnd))
+
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(report, f, indent=2)
+        finally:
+            f.close()
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print
+
+    if options.compare:
+        f = open(options.compare)
+        try:
+            old = json.load(f)
+        finally:
+            f.close()
+        compare(old, report)
+
+if __name__ == '__main__':
+    main()
@@ -84,6 +84,61 @@ Traceback (most recent call last):
 ValueError: The strings have unequal length
 
 
+>>> c = reedsolomon.Codec(7, 5)
+>>> data = bytearray('abcdefghij')
+>>> parity = bytearray(4)
+>>> view = memoryview(data)
+>>> c.encodebuffers([view[0:2], view[2:4], view[4:6], view[6:8], 'ij'],
+...                 [memoryview(parity)[0:2], memoryview(parity)[2:4]])
+>>> str(parity) == '[\x07&\xcf'
+True
+>>> chunks = [bytearray(s) for s in ('ab', 'cd', 'ef', 'gh', 'ij')]
+>>> chunks += [parity[0:2], parity[2:4]]
+>>> c.decodebuffers(chunks)
+[]
+>>> chunks[1][0] = 'x'
+>>> c.decodebuffers(chunks)
+[1]
+>>> [str(chunk) for chunk in chunks[:5]]
+['ab', 'cd', 'ef', 'gh', 'ij']
+>>> chunks[2] = bytearray('00')
+>>> chunks[4] = bytearray('00')
+>>> c.decodebuffers(chunks, [2, 4])
+[2, 4]
+>>> [str(chunk) for chunk in chunks[:5]]
+['ab', 'cd', 'ef', 'gh', 'ij']
+>>> c.decodebuffers(['ab', 'cd', 'ef', 'gh', 'ij', '[\x07', '&\xcf'])
+Traceback (most recent call last):
+  File "<stdin>", line 1, in ?
+BufferError: Object is not writable.
+>>> c.encodebuffers(['ab', 'cd', 'ef', 'gh', 'ijk'], [bytearray(2)] * 2)
+Traceback (most recent call last):
+  File "<stdin>", line 1, in ?
+ValueError: The buffers have unequal length
+
+>>> import mmap
+>>> maps = [mmap.mmap(-1, 2) for i in range(7)]
+>>> for m, s in zip(maps, ('ab', 'cd', 'ef', 'gh', 'ij')):
+...     m[:] = s
+>>> c.encodebuffers(maps[:5], maps[5:])
+>>> maps[5][:] + maps[6][:] == '[\x07&\xcf'
+True
+>>> maps[0][:] = 'xx'
+>>> c.decodebuffers(maps)
+[0]
+>>> maps[0][:]
+'ab'
+
+Old style buffers like array work, too, mixed with new style buffers:
+
+>>> import array
+>>> arrays = [array.array('c', s) for s in ('xx', 'cd', 'ef', 'gh', 'ij')]
+>>> c.decodebuffers(arrays + [bytearray('[\x07'), bytearray('&\xcf')])
+[0]
+>>> arrays[0].tostring()
+'ab'
+
+
 >>> c = reedsolomon.IntegerCodec(7, 5)
 >>> c.encode([1, 2, 3, 4, 5])
 [1, 2, 3, 4, 5, 113, 227]